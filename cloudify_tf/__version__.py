@@ -1 +1 @@
-version = '0.20.12'
+version = '0.20.13'
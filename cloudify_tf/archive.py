@@ -0,0 +1,174 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write the zip archives of terraform_source. Files are read, hashed and
+sampled in parallel threads, ahead of the writer, which adds them in order
+with the public ZipFile API. Members that are already compressed are only
+stored.
+"""
+
+import os
+import zlib
+import shutil
+import hashlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import CHUNK_SIZE
+
+DEFAULT_COMPRESSION_LEVEL = 6
+# Files with these extensions are not compressed again.
+INCOMPRESSIBLE_SUFFIXES = (
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.jar', '.whl',
+    '.png', '.jpg', '.jpeg', '.gif', '.pdf')
+# If the first SAMPLE_SIZE bytes of a file do not compress below
+# INCOMPRESSIBLE_RATIO, the file is only stored.
+SAMPLE_SIZE = 64 * 1024
+INCOMPRESSIBLE_RATIO = 0.9
+# The date_time of ZipInfo members created by name.
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def is_incompressible(file_path, sample=None):
+    """Whether compressing the file is a waste of time, by its extension or
+    by how well a sample of it compresses.
+    """
+    if file_path.lower().endswith(INCOMPRESSIBLE_SUFFIXES):
+        return True
+    if sample is None:
+        with open(file_path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    if len(sample) < 1024:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def get_compression_level(compression_level):
+    """Return the zlib level for an archive, the default if it's None, or
+    raise ValueError if it's not an integer from 0 to 9.
+    """
+    if compression_level is None:
+        return DEFAULT_COMPRESSION_LEVEL
+    if isinstance(compression_level, bool) or \
+            not isinstance(compression_level, int) or \
+            not 0 <= compression_level <= 9:
+        raise ValueError(
+            'The compression level must be an integer from 0 to 9, '
+            'not {!r}.'.format(compression_level))
+    return compression_level
+
+
+class _Member(object):
+    """A file that was hashed, and that is ready to be added to the
+    archive.
+    """
+
+    def __init__(self, file_path, arc_name, mode, size, sha256, stored):
+        self.file_path = file_path
+        self.arc_name = arc_name
+        self.mode = mode
+        self.size = size
+        self.sha256 = sha256
+        self.stored = stored
+
+
+class ArchiveWriter(object):
+    """Write files into a zip archive with fixed timestamps, so that the
+    same files always make the same archive.
+
+    :param archive_path: The zip file to create.
+    :param compression_level: The zlib level, 0 stores everything.
+    :param max_workers: The number of reading threads.
+    """
+
+    def __init__(self,
+                 archive_path,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 max_workers=None):
+        self.archive_path = archive_path
+        self.compression_level = get_compression_level(compression_level)
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+
+    def _prepare(self, file_path, arc_name, file_stat):
+        digest = hashlib.sha256()
+        size = 0
+        with open(file_path, 'rb') as src:
+            chunk = src.read(SAMPLE_SIZE)
+            stored = self.compression_level == 0 or \
+                is_incompressible(file_path, chunk)
+            while chunk:
+                digest.update(chunk)
+                size += len(chunk)
+                chunk = src.read(CHUNK_SIZE)
+        return _Member(file_path, arc_name, file_stat.st_mode & 0xFFFF,
+                       size, digest.hexdigest(), stored)
+
+    def _prepared(self, executor, files):
+        """Prepare the files in parallel, and yield them in order. Only a
+        few members are prepared ahead of the writer.
+        """
+        pending = deque()
+        for file_path, arc_name, file_stat in files:
+            pending.append(executor.submit(
+                self._prepare, file_path, arc_name, file_stat))
+            if len(pending) >= self.max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    @staticmethod
+    def _write_member(output_file, member):
+        # ZipFile.open applies the compression level of the archive only
+        # to members that it creates by name, which also get the fixed
+        # date. Stored members don't need a level. The size is known, so
+        # ZipFile decides on zip64 like ZipFile.write does.
+        force_zip64 = member.size * 1.05 > zipfile.ZIP64_LIMIT
+        if member.stored:
+            zip_info = zipfile.ZipInfo(member.arc_name,
+                                       date_time=FIXED_DATE_TIME)
+            zip_info.compress_type = zipfile.ZIP_STORED
+            zip_info.file_size = member.size
+            target = zip_info
+        else:
+            target = member.arc_name
+        with open(member.file_path, 'rb') as src, \
+                output_file.open(target, 'w', force_zip64=force_zip64) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        # The permissions are only written in the central directory.
+        output_file.getinfo(member.arc_name).external_attr = \
+            member.mode << 16
+
+    def write(self, files):
+        """Write the files, an iterable of (path, name in the archive,
+        os.stat result), and return [name, size, sha256] for each one.
+        """
+        manifest = []
+        with zipfile.ZipFile(self.archive_path,
+                             mode='w',
+                             compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=self.compression_level) \
+                as output_file, \
+                ThreadPoolExecutor(self.max_workers) as executor:
+            prepared = self._prepared(executor, files)
+            try:
+                for member in prepared:
+                    self._write_member(output_file, member)
+                    manifest.append([member.arc_name,
+                                     member.size,
+                                     member.sha256])
+            finally:
+                prepared.close()
+        return manifest
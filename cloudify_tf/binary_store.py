@@ -0,0 +1,310 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A store of executables, i.e. Terraform releases, that all the
+deployments of a tenant share. Every installation source is downloaded and
+extracted once, and linked into the node instance directories.
+"""
+
+import os
+import json
+import stat
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import tarfile
+import zipfile
+import tempfile
+from contextlib import contextmanager
+
+from ._compat import mkdir_p
+from .downloads import Downloader, DownloadError
+
+# Entries that were used recently may be linked by another operation.
+GRACE_PERIOD = 3600
+
+
+@contextmanager
+def file_lock(lock_path):
+    """An exclusive lock between the operations that share the store."""
+    mkdir_p(os.path.dirname(lock_path))
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _tree_size(dir_path):
+    return sum(os.path.getsize(os.path.join(dir_name, filename))
+               for dir_name, _, filenames in os.walk(dir_path)
+               for filename in filenames)
+
+
+def _is_linked(dir_path):
+    """Whether a file of the entry is hard linked from somewhere else."""
+    for dir_name, _, filenames in os.walk(dir_path):
+        for filename in filenames:
+            if os.stat(os.path.join(dir_name, filename)).st_nlink > 1:
+                return True
+    return False
+
+
+class BinaryStore(object):
+    """Executables by installation source and sha256.
+
+    root_dir/urls/<key>.json maps an installation source to the sha256 of
+    its download, root_dir/entries/<sha256> is the extracted download, and
+    root_dir/refs/<deployment ID>/<name>.json are the entries that node
+    instances use. References of deployments that no longer have a
+    directory in deployments_dir are dropped.
+
+    :param root_dir: The store directory.
+    :param deployments_dir: The deployments directory of the tenant.
+    :param size_limit: The size of the store in megabytes.
+    :param session: The requests session for the downloads.
+    :param timeout: The timeout of the requests.
+    :param logger: A logger.
+    """
+
+    def __init__(self,
+                 root_dir,
+                 deployments_dir,
+                 size_limit,
+                 session=None,
+                 timeout=None,
+                 logger=None):
+        self.root_dir = root_dir
+        self.deployments_dir = deployments_dir
+        self.size_limit = size_limit
+        self.logger = logger or logging.getLogger(__name__)
+        self.downloader = Downloader(os.path.join(root_dir, 'downloads'),
+                                     session=session,
+                                     max_workers=1,
+                                     timeout=timeout,
+                                     logger=self.logger)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _url_path(self, url):
+        return os.path.join(self.root_dir, 'urls', self.key(url) + '.json')
+
+    def _entry_path(self, digest):
+        return os.path.join(self.root_dir, 'entries', digest)
+
+    def _ref_path(self, owner):
+        return os.path.join(self.root_dir, 'refs', owner + '.json')
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _dump(path, data):
+        mkdir_p(os.path.dirname(path))
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(path), delete=False) as f:
+            json.dump(data, f)
+        os.replace(f.name, path)
+
+    @staticmethod
+    def _check_member(entry_dir, name, link_target=None):
+        """Raise DownloadError if an archive member, or the target of a
+        link, is outside of the entry directory.
+        """
+        path = os.path.normpath(os.path.join(entry_dir, name))
+        paths = [path]
+        if link_target is not None:
+            paths.append(os.path.normpath(
+                os.path.join(os.path.dirname(path), link_target)))
+        for member_path in paths:
+            if not member_path.startswith(os.path.join(entry_dir, '')):
+                raise DownloadError(
+                    'The archive member {name} is outside of the entry '
+                    'directory.'.format(name=name))
+
+    @classmethod
+    def _extract(cls, download, entry_dir, executable_name, suffix):
+        entry_dir = os.path.abspath(entry_dir)
+        if suffix and 'zip' in suffix:
+            with zipfile.ZipFile(download) as zip_file:
+                for zip_info in zip_file.infolist():
+                    mode = zip_info.external_attr >> 16
+                    link_target = zip_file.read(zip_info).decode('utf-8') \
+                        if stat.S_ISLNK(mode) else None
+                    cls._check_member(
+                        entry_dir, zip_info.filename, link_target)
+                    path = zip_file.extract(zip_info, entry_dir)
+                    os.chmod(path, mode & 0o777 or 0o755)
+        elif suffix and 'tar.gz' in suffix:
+            with tarfile.open(download, 'r:gz') as tar:
+                members = tar.getmembers()
+                for member in members:
+                    cls._check_member(
+                        entry_dir,
+                        member.name,
+                        member.linkname if member.issym() else None)
+                    if member.islnk():
+                        # Hard link targets are relative to the archive.
+                        cls._check_member(entry_dir, member.linkname)
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(entry_dir, members, filter='data')
+                else:
+                    tar.extractall(entry_dir, members)
+        else:
+            shutil.copy(download, os.path.join(entry_dir, executable_name))
+        executable = os.path.join(entry_dir, executable_name)
+        if os.path.isfile(executable):
+            os.chmod(executable, 0o755)
+        # The files are linked into node instance directories, so nobody
+        # should write to them.
+        for dir_name, _, filenames in os.walk(entry_dir):
+            for filename in filenames:
+                path = os.path.join(dir_name, filename)
+                os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+
+    def get(self, url, executable_name, suffix=None):
+        """Return the entry directory of url, and download and extract it
+        if it is not in the store yet.
+        """
+        with file_lock(os.path.join(
+                self.root_dir, 'locks', self.key(url) + '.lock')):
+            digest = self._load(self._url_path(url)).get('digest')
+            if digest and os.path.isdir(self._entry_path(digest)):
+                os.utime(self._url_path(url), None)
+                return self._entry_path(digest)
+            download = self.downloader.download(url)
+            digest = os.path.splitext(os.path.basename(download))[0]
+            entry_dir = self._entry_path(digest)
+            if not os.path.isdir(entry_dir):
+                mkdir_p(os.path.dirname(entry_dir))
+                tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+                os.chmod(tmp_dir, 0o755)
+                try:
+                    self._extract(download, tmp_dir, executable_name, suffix)
+                except Exception:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    raise
+                os.rename(tmp_dir, entry_dir)
+            os.remove(download)
+            self._dump(self._url_path(url), {'url': url, 'digest': digest})
+            return entry_dir
+
+    def install(self, url, executable_path, owner, suffix=None):
+        """Link the executable of url, and the files next to it, into the
+        directory of executable_path, and reference it by owner, i.e.
+        "<deployment ID>/<node instance ID>".
+        """
+        executable_name = os.path.basename(executable_path)
+        entry_dir = self.get(url, executable_name, suffix)
+        target_dir = os.path.dirname(executable_path)
+        mkdir_p(target_dir)
+        for dir_name, _, filenames in os.walk(entry_dir):
+            relative_dir = os.path.relpath(dir_name, entry_dir)
+            mkdir_p(os.path.join(target_dir, relative_dir))
+            for filename in filenames:
+                self.link(os.path.join(dir_name, filename),
+                          os.path.normpath(os.path.join(
+                              target_dir, relative_dir, filename)))
+        self._dump(self._ref_path(owner),
+                   {'digest': os.path.basename(entry_dir)})
+        self.prune()
+        return executable_path
+
+    @staticmethod
+    def link(source, target):
+        """Replace target with a hard link to source, or a symbolic link if
+        they are on different file systems.
+        """
+        tmp_path = '{}.{}.tmp'.format(target, os.getpid())
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            os.symlink(source, tmp_path)
+        os.replace(tmp_path, target)
+
+    def release(self, owner):
+        try:
+            os.remove(self._ref_path(owner))
+        except OSError:
+            pass
+
+    def _referenced_digests(self):
+        digests = set()
+        refs_dir = os.path.join(self.root_dir, 'refs')
+        if not os.path.isdir(refs_dir):
+            return digests
+        for deployment_id in os.listdir(refs_dir):
+            deployment_refs = os.path.join(refs_dir, deployment_id)
+            if not os.path.isdir(
+                    os.path.join(self.deployments_dir, deployment_id)):
+                shutil.rmtree(deployment_refs, ignore_errors=True)
+                continue
+            for ref in os.listdir(deployment_refs):
+                digest = self._load(
+                    os.path.join(deployment_refs, ref)).get('digest')
+                if digest:
+                    digests.add(digest)
+        return digests
+
+    def prune(self):
+        """Remove the least recently used entries until the store fits in
+        size_limit megabytes. Entries that live deployments reference, that
+        are hard linked, or that were used during the grace period are kept.
+        """
+        entries_dir = os.path.join(self.root_dir, 'entries')
+        if not os.path.isdir(entries_dir):
+            return
+        now = time.time()
+        last_used = {}
+        urls_dir = os.path.join(self.root_dir, 'urls')
+        for filename in os.listdir(urls_dir) \
+                if os.path.isdir(urls_dir) else []:
+            url_path = os.path.join(urls_dir, filename)
+            digest = self._load(url_path).get('digest')
+            if digest:
+                last_used[digest] = max(last_used.get(digest, 0),
+                                        os.path.getmtime(url_path))
+        entries = [os.path.join(entries_dir, d)
+                   for d in os.listdir(entries_dir)]
+        sizes = dict((entry, _tree_size(entry)) for entry in entries)
+        total = sum(sizes.values())
+        if total <= self.size_limit * 1024 * 1024:
+            return
+        referenced = self._referenced_digests()
+        entries.sort(key=lambda e: last_used.get(
+            os.path.basename(e), os.path.getmtime(e)))
+        for entry in entries:
+            if total <= self.size_limit * 1024 * 1024:
+                break
+            digest = os.path.basename(entry)
+            if digest in referenced or \
+                    now - last_used.get(digest, 0) < GRACE_PERIOD or \
+                    now - os.path.getmtime(entry) < GRACE_PERIOD or \
+                    _is_linked(entry):
+                continue
+            self.logger.debug('Evicting {} from the binary store.'.format(
+                entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
@@ -12,3 +12,38 @@ HCL_DICT_TEMPLATE = """{name} {{
 {indent}{indent}}}
 """
 HCL_STR_TEMPLATE = '{indent}{name} = "{value}"\n'
+PROVIDERS_INDEX_FILE = '.terraform_providers_index.json'
+SHARED_CACHE_DIR = '.terraform_plugin_cache'
+CHUNK_SIZE = 1024 * 1024
+PLAN_CACHE_DIR = '.terraform_plans'
+PLAN_CACHE_SIZE = 3
+INIT_FINGERPRINT_FILE = '.terraform_init_fingerprint.json'
+SOURCE_SYNC_FILE = '.terraform_source_sync.json'
+# What the plugin and terraform write into a module, as opposed to the
+# files of the module. The state is part of a plan key by itself.
+MODULE_DIGEST_EXCLUDE = (
+    '.terraform', PLAN_CACHE_DIR, PROVIDERS_INDEX_FILE, INIT_FINGERPRINT_FILE,
+    SOURCE_SYNC_FILE, TERRAFORM_STATE_FILE, TERRAFORM_STATE_FILE + '.backup',
+    'terraform.tfstate.d', '.terraform.tfstate.lock.info')
+INIT_FILE_SUFFIXES = ('.tf', '.tf.json', '.terraform.lock.hcl')
+PLUGIN_CACHE_DIR = 'providers'
+PLUGIN_CACHE_USAGE_FILE = '.usage.json'
+PLUGIN_CACHE_LOCK_FILE = '.usage.lock'
+# Megabytes.
+PLUGIN_CACHE_SIZE_LIMIT = 10240
+# Providers that were used recently may be linked by an init in progress.
+PLUGIN_CACHE_GRACE_PERIOD = 3600
+PROVIDER_PACKAGE_PATTERN = \
+    r'terraform-provider-[^_]+_(?P<version>[^_]+)_(?P<os>[^_]+)_' \
+    r'(?P<arch>[^_.]+)\.zip$'
+SOURCE_STORE_DIR = 'sources'
+TREE_DEPTH_LIMIT = 4
+TREE_LENGTH_LIMIT = 1000
+TREE_EXCLUDE_DIRS = ('.terraform',)
+URL_PROBE_TIMEOUT = 10
+REMOTE_SOURCE_CACHE_DIR = 'remote_sources'
+REMOTE_SOURCE_CACHE_SIZE_LIMIT = 2048
+PROVIDER_DOWNLOADS_DIR = 'provider_downloads'
+PROVIDER_DOWNLOADS_SIZE_LIMIT = 2048
+BINARY_STORE_DIR = 'binaries'
+BINARY_STORE_SIZE_LIMIT = 2048
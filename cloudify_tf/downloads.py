@@ -0,0 +1,269 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Download release archives, i.e. Terraform providers, in parallel into a
+content addressed cache. Downloads are resumed with ranged requests, and
+verified against the SHA256SUMS file of HashiCorp style releases.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ._compat import mkdir_p
+from .constants import CHUNK_SIZE
+
+RETRIES = 3
+# Blobs that were used recently may be extracted by another operation.
+GRACE_PERIOD = 3600
+# <product>_<version>_<os>_<arch>.zip, whose checksums are in
+# <product>_<version>_SHA256SUMS next to it.
+RELEASE_ARCHIVE_PATTERN = re.compile(
+    r'^(?P<release>[^_/]+_[^_/]+)_[^_/]+_[^_/]+\.zip$')
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def get_checksums_url(url):
+    """The URL of the SHA256SUMS of a release archive, or None."""
+    bare_url = url.split('?')[0]
+    base_url, filename = bare_url.rsplit('/', 1)
+    match = RELEASE_ARCHIVE_PATTERN.match(filename)
+    if match:
+        return '{}/{}_SHA256SUMS'.format(base_url, match.group('release'))
+
+
+def parse_checksums(text):
+    """Parse a SHA256SUMS file: "<sha256>  <filename>" per line."""
+    checksums = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            checksums[parts[1].lstrip('*')] = parts[0].lower()
+    return checksums
+
+
+class Downloader(object):
+    """Download URLs into cache_dir/blobs/<sha256>, and remember which blob
+    every URL downloaded to, so that a URL is only downloaded once.
+
+    :param cache_dir: The cache directory.
+    :param session: The requests session.
+    :param max_workers: The number of parallel downloads.
+    :param timeout: The timeout of the requests.
+    :param logger: A logger.
+    """
+
+    def __init__(self,
+                 cache_dir,
+                 session=None,
+                 max_workers=8,
+                 timeout=None,
+                 logger=None):
+        self.cache_dir = cache_dir
+        self.session = session or requests.Session()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self._checksums = {}
+        self._checksums_lock = threading.Lock()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest + '.zip')
+
+    def _url_path(self, url):
+        return os.path.join(self.cache_dir, 'urls', _url_key(url) + '.json')
+
+    def cached(self, url):
+        """The path of the blob that the URL downloaded to, or None."""
+        try:
+            with open(self._url_path(url)) as f:
+                blob_path = self._blob_path(json.load(f)['digest'])
+        except (IOError, OSError, ValueError, KeyError):
+            return
+        if os.path.isfile(blob_path):
+            os.utime(blob_path, None)
+            return blob_path
+
+    def checksums(self, url):
+        """The checksums of the release of url, or None if it does not have
+        a SHA256SUMS file. They are requested once per release.
+        """
+        checksums_url = get_checksums_url(url)
+        if not checksums_url:
+            return
+        with self._checksums_lock:
+            if checksums_url not in self._checksums:
+                response = self.session.get(checksums_url,
+                                            timeout=self.timeout)
+                if response.ok:
+                    self._checksums[checksums_url] = parse_checksums(
+                        response.text)
+                else:
+                    self._checksums[checksums_url] = None
+            return self._checksums[checksums_url]
+
+    def _fetch(self, url, part):
+        """Download url into the file part, resuming what is already in it.
+        """
+        for attempt in range(RETRIES):
+            offset = part.seek(0, os.SEEK_END)
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            try:
+                with self.session.get(url,
+                                      headers=headers,
+                                      allow_redirects=True,
+                                      stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code == 416:
+                        # The file is complete.
+                        return
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        part.seek(0)
+                        part.truncate()
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        part.write(chunk)
+                    part.flush()
+                return
+            except (requests.ConnectionError,
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                part.flush()
+                if attempt == RETRIES - 1:
+                    raise DownloadError(
+                        'Failed to download {url}: {error}'.format(
+                            url=url, error=e))
+                self.logger.debug('Resuming the download of {url}.'.format(
+                    url=url))
+
+    def _verify(self, url, part_path):
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        checksums = self.checksums(url)
+        if checksums is None:
+            self.logger.debug('There is no SHA256SUMS for {url}.'.format(
+                url=url))
+            return digest
+        filename = url.split('?')[0].rsplit('/', 1)[1]
+        if checksums.get(filename) != digest:
+            os.remove(part_path)
+            raise DownloadError(
+                'The sha256 of {url}, {digest}, does not match its '
+                'SHA256SUMS: {expected}.'.format(
+                    url=url, digest=digest, expected=checksums.get(filename)))
+        return digest
+
+    def download(self, url):
+        """Return the path of the verified blob of url, and download it if
+        it is not in the cache.
+        """
+        blob_path = self.cached(url)
+        if blob_path:
+            return blob_path
+        part_path = os.path.join(
+            self.cache_dir, 'partial', _url_key(url) + '.part')
+        mkdir_p(os.path.dirname(part_path))
+        with open(part_path, 'ab+') as part:
+            # Another operation may be downloading the same URL.
+            fcntl.flock(part, fcntl.LOCK_EX)
+            try:
+                blob_path = self.cached(url)
+                if blob_path:
+                    return blob_path
+                self.logger.debug('Downloading {url}.'.format(url=url))
+                self._fetch(url, part)
+                digest = self._verify(url, part_path)
+                blob_path = self._blob_path(digest)
+                mkdir_p(os.path.dirname(blob_path))
+                os.replace(part_path, blob_path)
+                url_path = self._url_path(url)
+                mkdir_p(os.path.dirname(url_path))
+                with tempfile.NamedTemporaryFile(
+                        'w', dir=os.path.dirname(url_path),
+                        delete=False) as f:
+                    json.dump({'url': url, 'digest': digest}, f)
+                os.replace(f.name, url_path)
+                return blob_path
+            finally:
+                fcntl.flock(part, fcntl.LOCK_UN)
+
+    def download_all(self, urls):
+        """Download the URLs in parallel, and return a dict of URL to blob
+        path. Errors are raised together after all the downloads ended.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(
+                min(self.max_workers, len(urls))) as executor:
+            futures = dict((url, executor.submit(self.download, url))
+                           for url in urls)
+        paths = {}
+        errors = []
+        for url, future in futures.items():
+            try:
+                paths[url] = future.result()
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise DownloadError('\n'.join(errors))
+        return paths
+
+    def prune(self, size_limit):
+        """Remove the least recently used blobs until the cache fits in
+        size_limit megabytes.
+        """
+        blobs_dir = os.path.join(self.cache_dir, 'blobs')
+        if not os.path.isdir(blobs_dir):
+            return
+        now = time.time()
+        blobs = []
+        for filename in os.listdir(blobs_dir):
+            blob_path = os.path.join(blobs_dir, filename)
+            try:
+                blob_stat = os.stat(blob_path)
+            except OSError:
+                continue
+            blobs.append((blob_stat.st_mtime, blob_stat.st_size, blob_path))
+        blobs.sort()
+        total = sum(size for _, size, _ in blobs)
+        for mtime, size, blob_path in blobs:
+            if total <= size_limit * 1024 * 1024 or \
+                    now - mtime < GRACE_PERIOD:
+                break
+            try:
+                os.remove(blob_path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,336 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache of remote terraform sources, so that reloading an unchanged
+source is a conditional request and a local copy. HTTP sources are
+revalidated with their ETag or Last-Modified, and git sources with the
+commit of their ref.
+"""
+
+import os
+import re
+import hmac
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+
+import requests
+
+# Entries that were used recently may be copied by another operation.
+GRACE_PERIOD = 3600
+SECRET_FILE = '.secret'
+COMMIT_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+USERINFO_PATTERN = re.compile(r'(?<=://)[^/@\s]+@')
+# Git asks GIT_ASKPASS for the credentials, so that they are not in the
+# URL, where they would show up in errors and in the process list.
+ASKPASS_SCRIPT = """#!/bin/sh
+case "$1" in
+    Username*) printf '%s\\n' "$CLOUDIFY_TF_GIT_USERNAME" ;;
+    *) printf '%s\\n' "$CLOUDIFY_TF_GIT_PASSWORD" ;;
+esac
+"""
+
+
+def redact(text, *secrets):
+    """Remove credentials from text: the user info of URLs, and secrets."""
+    text = USERINFO_PATTERN.sub('***@', str(text))
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret, '***')
+    return text
+
+
+@contextmanager
+def git_credentials(username=None, password=None):
+    """Yield the environment for git commands that authenticate with
+    username and password, without prompting.
+    """
+    env = {'GIT_TERMINAL_PROMPT': '0'}
+    if not username:
+        yield env
+        return
+    askpass_dir = tempfile.mkdtemp()
+    try:
+        askpass = os.path.join(askpass_dir, 'askpass.sh')
+        with open(askpass, 'w') as f:
+            f.write(ASKPASS_SCRIPT)
+        os.chmod(askpass, 0o700)
+        env.update({
+            'GIT_ASKPASS': askpass,
+            'CLOUDIFY_TF_GIT_USERNAME': username,
+            'CLOUDIFY_TF_GIT_PASSWORD': password or '',
+        })
+        yield env
+    finally:
+        shutil.rmtree(askpass_dir, ignore_errors=True)
+
+
+def _tree_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dir_name, filename))
+               for dir_name, _, filenames in os.walk(path)
+               for filename in filenames)
+
+
+class RemoteSourceCache(object):
+    """Cache the sources that fetch downloads, by location and credentials.
+
+    :param root_dir: The cache directory.
+    :param size_limit: The size of the cache in megabytes.
+    :param session: The requests session for the validation requests.
+    :param timeout: The timeout of the validation requests.
+    :param logger: A logger.
+    """
+
+    def __init__(self,
+                 root_dir,
+                 size_limit,
+                 session=None,
+                 timeout=None,
+                 logger=None):
+        self.root_dir = root_dir
+        self.size_limit = size_limit
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def kind(location):
+        """git, http or None, for the sources that are not cached."""
+        if not isinstance(location, str):
+            return
+        bare_location = location.split('?')[0]
+        if location.startswith('git::') or location.startswith('git@') \
+                or bare_location.endswith('.git'):
+            return 'git'
+        if location.split('://')[0] in ['http', 'https']:
+            return 'http'
+
+    def _secret(self):
+        """The random secret of this cache, which is created once, and that
+        only the owner can read.
+        """
+        secret_path = os.path.join(self.root_dir, SECRET_FILE)
+        if not os.path.exists(secret_path):
+            with tempfile.NamedTemporaryFile(
+                    'wb', dir=self.root_dir, delete=False) as f:
+                f.write(os.urandom(32))
+            try:
+                # Linking fails if another operation created it first.
+                os.link(f.name, secret_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(f.name)
+        with open(secret_path, 'rb') as f:
+            return f.read()
+
+    def key(self, location, username=None, password=None):
+        """The entry of a location and its credentials. It's an HMAC with
+        the secret of the cache, so that the passwords can't be guessed
+        from the names of the entries.
+        """
+        identity = json.dumps([location, username, password])
+        return hmac.new(self._secret(),
+                        identity.encode('utf-8'),
+                        hashlib.sha256).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join(self.root_dir, key + '.json')
+
+    def _load_meta(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _dump_meta(self, key, meta):
+        with tempfile.NamedTemporaryFile(
+                'w', dir=self.root_dir, delete=False) as f:
+            json.dump(meta, f)
+        os.replace(f.name, self._meta_path(key))
+
+    def _http_validators(self, location, meta, username, password):
+        """Return (whether the cached copy is fresh, the new validators).
+        This is a conditional HEAD request. Servers that do not support HEAD
+        get a conditional GET instead, which is streamed, so that only its
+        headers are read, and the body is downloaded by fetch.
+        """
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        kwargs = {
+            'headers': headers,
+            'auth': (username, password) if username else None,
+            'allow_redirects': True,
+            'timeout': self.timeout,
+        }
+        response = self.session.head(location, **kwargs)
+        if response.status_code in [405, 501]:
+            response = self.session.get(location, stream=True, **kwargs)
+            response.close()
+        if response.status_code == 304:
+            return True, {}
+        response.raise_for_status()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if not any(validators.values()):
+            return False, {}
+        return False, validators
+
+    @staticmethod
+    def _git_remote(location):
+        ref = None
+        if location.startswith('git::'):
+            location = location[len('git::'):]
+        if '?ref=' in location:
+            location, ref = location.split('?ref=')
+        return location, ref
+
+    def _git_validators(self, location, meta, username, password):
+        url, ref = self._git_remote(location)
+        if ref and COMMIT_PATTERN.match(ref):
+            commit = ref
+        else:
+            import git
+            with git_credentials(username, password) as env:
+                lines = git.cmd.Git().ls_remote(
+                    url, ref or 'HEAD', env=env).splitlines()
+            if not lines:
+                return False, {}
+            commit = lines[0].split()[0]
+        return commit == meta.get('commit'), {'commit': commit}
+
+    def _copy(self, meta, dir=None):
+        """A copy of the cached content, where fetch would put it. Files are
+        put in dir, and directories in a temporary directory.
+        """
+        content = os.path.join(self.root_dir, meta['content'])
+        if os.path.isdir(content):
+            target = os.path.join(tempfile.mkdtemp(), meta['name'])
+            shutil.copytree(content, target, symlinks=True)
+        else:
+            target = os.path.join(dir or tempfile.mkdtemp(), meta['name'])
+            shutil.copy2(content, target)
+        return target
+
+    def _store(self, key, location, path, validators, previous=None):
+        if previous:
+            # Give operations that are copying the previous content time to
+            # finish, before prune removes it.
+            try:
+                os.utime(os.path.join(
+                    self.root_dir, previous.split(os.sep)[0]), None)
+            except OSError:
+                pass
+        entry_dir = tempfile.mkdtemp(dir=self.root_dir, prefix=key + '.')
+        content = os.path.join(entry_dir, 'content')
+        if os.path.isdir(path):
+            shutil.copytree(path, content, symlinks=True)
+        else:
+            shutil.copy2(path, content)
+        meta = {
+            'location': redact(location),
+            'content': os.path.relpath(content, self.root_dir),
+            'name': 'source' if os.path.isdir(path)
+            else os.path.basename(path),
+            'size': _tree_size(content),
+        }
+        meta.update(validators)
+        self._dump_meta(key, meta)
+
+    def get(self, location, fetch, username=None, password=None, dir=None):
+        """Return the path of the source at location, either a copy from the
+        cache or what fetch returns, which is called to download it.
+        """
+        kind = self.kind(location)
+        if not kind:
+            return fetch()
+        key = self.key(location, username, password)
+        meta = self._load_meta(key)
+        if meta and not os.path.exists(
+                os.path.join(self.root_dir, meta.get('content', ''))):
+            meta = {}
+        try:
+            if kind == 'git':
+                fresh, validators = self._git_validators(
+                    location, meta, username, password)
+            else:
+                fresh, validators = self._http_validators(
+                    location, meta, username, password)
+        except Exception as e:
+            self.logger.debug(
+                'Not caching {location}: {error}'.format(
+                    location=redact(location, password),
+                    error=redact(e, password)))
+            return fetch()
+
+        if fresh and meta:
+            self.logger.debug('Using the cached source of {}.'.format(
+                redact(location, password)))
+            os.utime(self._meta_path(key), None)
+            return self._copy(meta, dir)
+
+        path = fetch()
+        if validators and path != location and os.path.exists(path):
+            self._store(key, location, path, validators, meta.get('content'))
+            self.prune()
+        return path
+
+    def prune(self):
+        """Evict the least recently used sources until the cache fits in
+        size_limit megabytes, and remove the content that no entry uses.
+        """
+        now = time.time()
+        entries = []
+        used = set()
+        for filename in os.listdir(self.root_dir):
+            if not filename.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.root_dir, filename)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                entries.append(
+                    (os.path.getmtime(meta_path), meta_path, meta))
+            except (IOError, OSError, ValueError):
+                continue
+        entries.sort(key=lambda e: e[0])
+        total = sum(meta.get('size', 0) for _, _, meta in entries)
+        limit = self.size_limit * 1024 * 1024
+        for mtime, meta_path, meta in entries:
+            if total > limit and now - mtime >= GRACE_PERIOD:
+                self.logger.debug('Evicting {} from the source cache.'.format(
+                    meta.get('location')))
+                os.remove(meta_path)
+                total -= meta.get('size', 0)
+            else:
+                used.add(meta.get('content', '').split(os.sep)[0])
+        for filename in os.listdir(self.root_dir):
+            entry_dir = os.path.join(self.root_dir, filename)
+            if not os.path.isdir(entry_dir) or filename in used:
+                continue
+            if now - os.path.getmtime(entry_dir) >= GRACE_PERIOD:
+                shutil.rmtree(entry_dir, ignore_errors=True)
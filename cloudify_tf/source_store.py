@@ -0,0 +1,149 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content addressed storage for the terraform_source archives, so that the
+runtime properties only keep a digest, and node instances with the same
+material share one copy of it.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+
+from ._compat import mkdir_p
+from .constants import CHUNK_SIZE
+
+# Unreferenced archives may belong to an operation in progress.
+GRACE_PERIOD = 3600
+PRUNE_INTERVAL = 3600
+
+
+class SourceStore(ABC):
+    """Stores source archives by their sha256 digest. Every owner, i.e. a
+    node instance, references one archive at a time.
+    """
+
+    @abstractmethod
+    def put(self, archive_path, owner):
+        """Store the archive, reference it by owner and return its digest.
+        """
+
+    @abstractmethod
+    def get(self, digest):
+        """Return the path of a stored archive, or None."""
+
+
+class LocalSourceStore(SourceStore):
+    """A store in a directory that all the deployments of a tenant can
+    reach. Owners are "<deployment ID>/<node instance ID>", and references
+    of deployments that no longer have a directory in deployments_dir are
+    dropped.
+    """
+
+    def __init__(self, root_dir, deployments_dir):
+        self.root_dir = root_dir
+        self.deployments_dir = deployments_dir
+        self.blobs_dir = os.path.join(root_dir, 'blobs')
+        self.refs_dir = os.path.join(root_dir, 'refs')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest + '.zip')
+
+    def _ref_path(self, owner):
+        return os.path.join(self.refs_dir, owner + '.json')
+
+    @staticmethod
+    def digest(archive_path):
+        digest = hashlib.sha256()
+        with open(archive_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def put(self, archive_path, owner):
+        digest = self.digest(archive_path)
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            # Reset the grace period.
+            os.utime(blob_path, None)
+        else:
+            mkdir_p(os.path.dirname(blob_path))
+            with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(blob_path), delete=False) as f:
+                with open(archive_path, 'rb') as archive:
+                    shutil.copyfileobj(archive, f, CHUNK_SIZE)
+            os.replace(f.name, blob_path)
+        ref_path = self._ref_path(owner)
+        mkdir_p(os.path.dirname(ref_path))
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(ref_path), delete=False) as f:
+            json.dump({'digest': digest}, f)
+        os.replace(f.name, ref_path)
+        self.prune()
+        return digest
+
+    def get(self, digest):
+        blob_path = self._blob_path(digest)
+        if os.path.isfile(blob_path):
+            return blob_path
+
+    def _referenced_digests(self):
+        digests = set()
+        if not os.path.isdir(self.refs_dir):
+            return digests
+        for deployment_id in os.listdir(self.refs_dir):
+            deployment_refs = os.path.join(self.refs_dir, deployment_id)
+            if not os.path.isdir(
+                    os.path.join(self.deployments_dir, deployment_id)):
+                shutil.rmtree(deployment_refs, ignore_errors=True)
+                continue
+            for ref in os.listdir(deployment_refs):
+                try:
+                    with open(os.path.join(deployment_refs, ref)) as f:
+                        digests.add(json.load(f)['digest'])
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+        return digests
+
+    def prune(self):
+        """Remove the archives that no owner references, at most once per
+        PRUNE_INTERVAL.
+        """
+        marker = os.path.join(self.root_dir, '.pruned')
+        now = time.time()
+        try:
+            if now - os.path.getmtime(marker) < PRUNE_INTERVAL:
+                return
+        except OSError:
+            pass
+        with open(marker, 'w'):
+            pass
+        referenced = self._referenced_digests()
+        for dir_name, _, filenames in os.walk(self.blobs_dir):
+            for filename in filenames:
+                blob_path = os.path.join(dir_name, filename)
+                # Leftover temporary files are removed too.
+                digest = os.path.splitext(filename)[0]
+                try:
+                    if digest in referenced or \
+                            now - os.path.getmtime(blob_path) < GRACE_PERIOD:
+                        continue
+                    os.remove(blob_path)
+                except OSError:
+                    continue
@@ -22,7 +22,6 @@ from cloudify import ctx as ctx_from_imports
 from cloudify.utils import exception_to_error_cause
 from cloudify.exceptions import NonRecoverableError, RecoverableError
 from cloudify_common_sdk.utils import (
-    install_binary,
     update_dict_values,
     get_node_instance_dir)
 
@@ -208,21 +207,45 @@ def compare_plan_results(new_plan, old_plan):
             'Please Rerun plan workflow before executing apply worfklow.')
 
 
+class FailedPreApplyChecks(NonRecoverableError):
+    pass
+
+
+def run_pre_apply_checks(tf, old_plan=None):
+    """Compare the plan with old_plan, and run TFLint and TFSec. They only
+    read the module, so they run concurrently. If one check fails its error
+    is raised, and if several fail they are raised together.
+    """
+    checks = []
+    if old_plan:
+        checks.append(
+            lambda: compare_plan_results(tf.plan_and_show(), old_plan))
+    if getattr(tf, 'tflint', None):
+        checks.append(tf.check_tflint)
+    if getattr(tf, 'tfsec', None):
+        checks.append(tf.check_tfsec)
+    errors = utils.run_concurrently(checks)
+    if len(errors) == 1:
+        raise errors[0]
+    elif errors:
+        raise FailedPreApplyChecks(
+            'Failed the checks before apply:\n{}'.format(
+                '\n'.join(str(e) for e in errors)),
+            causes=[exception_to_error_cause(e, e.__traceback__)
+                    for e in errors])
+
+
 def _apply(tf, old_plan=None, force=False):
     try:
         tf.init()
         if tf.terratag:
             tf.run_terratag()
-        if old_plan and not force:
-            new_plan = tf.plan_and_show()
-            compare_plan_results(new_plan, old_plan)
         if not force:
-            tf.check_tflint()
-            tf.check_tfsec()
+            run_pre_apply_checks(tf, old_plan)
         tf.apply()
         tf_state = tf.show()
         tf_output = tf.output()
-    except (FailedPlanValidation, TFToolException):
+    except (FailedPlanValidation, FailedPreApplyChecks, TFToolException):
         raise
     except FileNotFoundError as ex:
         _, _, tb = sys.exc_info()
@@ -244,7 +267,7 @@ def _plan(tf):
         if tf.terratag:
             tf.run_terratag()
         tf.state_pull()
-        return tf.plan_and_show_two_formats()
+        return tf.plan_and_show_two_formats(use_cache=False)
     except Exception as ex:
         _, _, tb = sys.exc_info()
         raise NonRecoverableError(
@@ -367,10 +390,17 @@ def state_pull(ctx, tf, **_):
 
 def _state_pull(tf, update_runtime_props=True):
     try:
+        # Refresh once and store the refreshed state. The plan compares it
+        # to the configuration without refreshing again, and it gives us
+        # the outputs. The state is still pulled on its own, since the
+        # resources are stored in the raw state format, which the plan
+        # doesn't have. This only reads the file for the local backend.
         tf.refresh()
         tf_state = tf.state_pull()
-        plan_json = tf.plan_and_show()
-        tf_output = tf.output()
+        plan_json = tf.plan_and_show(use_cache=False, refresh=False)
+        tf_output = utils.get_plan_outputs(plan_json)
+        if tf_output is None:
+            tf_output = tf.output()
     except Exception as ex:
         _, _, tb = sys.exc_info()
         # TODO: make sure it's recoverable only on not syncing plugins
@@ -527,7 +557,7 @@ def install(ctx, installation_source=None, **_):
                         'If you do not have sufficient permissions, that '
                         'installation will fail.'.format(
                             loc=executable_path))
-        install_binary(
+        utils.install_executable(
             installation_dir, executable_path, installation_source, 'tf.zip')
 
     # store the values in the runtime for safe keeping -> validation
@@ -552,6 +582,7 @@ def uninstall(ctx, **_):
             ctx.logger.info('Removing executable: {path}'.format(
                 path=exc_path))
             os.remove(exc_path)
+            utils.release_executable()
 
     for property_name, property_desc in [
         ('plugins_dir',
@@ -16,6 +16,8 @@
 import os
 import re
 import json
+import shutil
+import hashlib
 import tempfile
 from distutils.version import LooseVersion as parse_version
 
@@ -23,6 +25,7 @@ from .tfsec import TFSec
 from .tflint import TFLint
 from .terratag import Terratag
 from .infracost import Infracost
+from .plan_renderer import render_plan
 from contextlib import contextmanager
 from cloudify import exceptions as cfy_exc
 from cloudify_common_sdk.cli_tool_base import CliTool
@@ -35,9 +38,19 @@ from cloudify_common_sdk.utils import (
 from script_runner.tasks import ProcessException
 
 from .. import utils
+from ..constants import (
+    PLAN_CACHE_DIR,
+    PLAN_CACHE_SIZE,
+    INIT_FILE_SUFFIXES,
+    TERRAFORM_STATE_FILE,
+    INIT_FINGERPRINT_FILE,
+    PLUGIN_CACHE_SIZE_LIMIT
+)
 
 
 CREATE_OP = 'cloudify.interfaces.lifecycle.create'
+NESTED_HELP_TEXT = 'For more information on those options, run:'
+STALE_PLAN_TEXT = 'Saved plan is stale'
 
 
 class Terraform(CliTool):
@@ -59,7 +72,9 @@ class Terraform(CliTool):
                  version=None,
                  flags_override=None,
                  log_stdout=True,
-                 tfvars=None):
+                 tfvars=None,
+                 render_plain_text_plan=True,
+                 plugin_cache_size_limit=None):
 
         try:
             deployment_name = root_module.split('/')[-2]
@@ -85,11 +100,13 @@ class Terraform(CliTool):
         self._version = version
         self._flags = None
         self._flags_override = flags_override or []
+        self._supported_flags = {}
         self._log_stdout = log_stdout
         self._tflint = None
         self._tfsec = None
         self._terratag = None
         self._infracost = None
+        self._plans = None
 
         if not isinstance(environment_variables, dict):
             raise Exception(
@@ -110,6 +127,8 @@ class Terraform(CliTool):
         self._variables = variables
         self.provider_upgrade = provider_upgrade
         self._tfvars = tfvars
+        self.render_plain_text_plan = render_plain_text_plan
+        self.plugin_cache_size_limit = plugin_cache_size_limit
 
     @property
     def root_module(self):
@@ -212,34 +231,15 @@ class Terraform(CliTool):
             return
         return path
 
+    def get_supported_flags(self, subcommand):
+        if subcommand not in self._supported_flags:
+            self._supported_flags[subcommand] = get_help_flags(
+                self.execute, self.binary_path, subcommand)
+        return self._supported_flags[subcommand]
+
     def get_valid_override_flags(self, command_args):
-        def get_cleaned_flags(help_result):
-            cleaned_flags = []
-            # this will get us the options
-            options = help_result[help_result.find('Options:'):]
-            # clear any default value in flag
-            for flag in re.findall(r"\s+-([^ ]+) .*", options):
-                cleaned_flags.append("--{0}".format(flag.partition('=')[0]))
-            return cleaned_flags
-
-        cleaned_flags = []
         subcommand = command_args[0]
-        help_result = self.execute([self.binary_path, subcommand, '-help'])
-        cleaned_flags = get_cleaned_flags(help_result)
-        # check if it has nested_help options
-        nested_help_text = 'For more information on those options, run:'
-        # get the help command by adding len of nested_help_text
-        help_text_index = help_result.find(nested_help_text)
-        if not cleaned_flags and help_text_index > -1:
-            nested_help = help_result[help_text_index+43:]
-            # replace terraform with correct binary_path
-            help_command = [self.binary_path]
-            help_command.extend(nested_help.split()[1:])
-            help_result = self.execute(help_command)
-            nested_flags = get_cleaned_flags(help_result)
-            for flag in nested_flags:
-                if flag not in cleaned_flags:
-                    cleaned_flags.append(flag)
+        cleaned_flags = self.get_supported_flags(subcommand)
         # remove extra - from the formatted_flags and pick the flag
         # that is part of the supported flags by the command
         final_flags = [flag[1:] for flag in self.flags
@@ -259,14 +259,7 @@ class Terraform(CliTool):
                 ['chmod', 'u+x', self.binary_path],
                 self.logger)
         # look for all providers to make them executable as well
-        providers_path = os.path.join(self.root_module, '.terraform')
-        for things in os.walk(providers_path):
-            for provider_file in things[2]:
-                provider_path = os.path.join(things[0], provider_file)
-                if not os.access(provider_path, os.X_OK):
-                    run_subprocess(
-                        ['chmod', 'u+x', provider_path],
-                        self.logger)
+        utils.make_providers_executable(self.root_module)
         try:
             return run_subprocess(
                 command,
@@ -277,12 +270,12 @@ class Terraform(CliTool):
                 return_output=return_output)
         except ProcessException as e:
             if e.exit_code == 2 and \
-                'panic: runtime error: invalid memory address ' \
-                'or nil pointer dereference' in e.stderr:
-            raise cfy_exc.OperationRetry(
-                f'Failed to call: {e.command}. '
-                f'A temporary error was raised: {e.stderr}.')
-
+                    'panic: runtime error: invalid memory address ' \
+                    'or nil pointer dereference' in e.stderr:
+                raise cfy_exc.OperationRetry(
+                    f'Failed to call: {e.command}. '
+                    f'A temporary error was raised: {e.stderr}.')
+            raise
 
     def _tf_command(self, args):
         cmd = [self.binary_path]
@@ -316,16 +309,19 @@ class Terraform(CliTool):
             command.extend(['-var-file={}'.format(self.tfvars)])
             yield
         else:
+            # Not in the root module: commands that run at the same time
+            # would see each other's files, and the module would change.
+            runtime_dir = tempfile.mkdtemp()
             with tempfile.NamedTemporaryFile(suffix=".json",
                                              delete=False,
                                              mode="w",
-                                             dir=self.root_module) as f:
+                                             dir=runtime_dir) as f:
                 json.dump(self.insecure_variables, f)
                 f.close()
                 command.extend(['-var-file', f.name])
                 yield
             if delete_debug():
-                os.remove(f.name)
+                shutil.rmtree(runtime_dir, ignore_errors=True)
 
     @contextmanager
     def plan_file(self):
@@ -410,7 +406,63 @@ class Terraform(CliTool):
     def tfvars(self, value):
         self._tfvars = value
 
+    @property
+    def init_fingerprint_file(self):
+        return os.path.join(self.root_module, INIT_FINGERPRINT_FILE)
+
+    def init_fingerprint(self):
+        """Everything that terraform init depends on: the configuration,
+        the lock file, the plugins dir and the binary.
+        """
+        inputs = [
+            utils.get_module_digest(self.root_module, INIT_FILE_SUFFIXES),
+            utils.get_file_sha256(self.binary_path),
+            self.plugins_dir,
+            utils.get_tree_signature(self.plugins_dir),
+        ]
+        return hashlib.sha256(json.dumps(
+            inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_initialized(self):
+        dot_terraform = os.path.join(self.root_module, '.terraform')
+        if self.provider_upgrade or not os.path.isdir(dot_terraform):
+            return False
+        # Providers that were evicted from the plugin cache leave broken
+        # links behind.
+        if utils.has_broken_links(os.path.join(dot_terraform, 'providers')):
+            return False
+        stored = utils.load_json_file(self.init_fingerprint_file)
+        return stored.get('fingerprint') == self.init_fingerprint()
+
     def init(self, command_line_args=None, prefix=None, no_input=True):
+        if not command_line_args and not prefix and self.is_initialized():
+            self.logger.debug('The module did not change since the last '
+                              'terraform init, skipping it.')
+            return
+        result = self._init(command_line_args, prefix, no_input)
+        self.update_plugin_cache()
+        # Init may write the lock file, so take the fingerprint afterwards.
+        try:
+            utils.dump_json_file(self.init_fingerprint_file,
+                                 {'fingerprint': self.init_fingerprint()})
+        except (IOError, OSError) as e:
+            self.logger.debug(
+                'Unable to store the init fingerprint: {}'.format(str(e)))
+        return result
+
+    def update_plugin_cache(self):
+        plugin_cache_dir = self._env.get('TF_PLUGIN_CACHE_DIR')
+        if not plugin_cache_dir or not self.plugin_cache_size_limit:
+            return
+        try:
+            utils.update_plugin_cache(plugin_cache_dir,
+                                      self.root_module,
+                                      self.plugin_cache_size_limit)
+        except (IOError, OSError) as e:
+            self.logger.debug(
+                'Unable to update the plugin cache: {}'.format(str(e)))
+
+    def _init(self, command_line_args=None, prefix=None, no_input=True):
         cmdline = ['init', '-no-color']
         if no_input:
             cmdline.append('-input=false')
@@ -449,14 +501,30 @@ class Terraform(CliTool):
         with self.runtime_file(command):
             return self.execute(command)
 
-    def plan(self, out_file_path=None):
+    def plan(self, out_file_path=None, refresh=True):
         command = self._tf_command(['plan', '-no-color', '-input=false'])
+        if not refresh:
+            command.append('-refresh=false')
         if out_file_path:
             command.extend(['-out', out_file_path])
         with self.runtime_file(command):
             return self.execute(command, False)
 
     def apply(self):
+        """Apply the cached plan for the current inputs, if there is one,
+        otherwise let terraform apply make a new plan.
+        """
+        entry = self.get_cached_plan()
+        if entry:
+            try:
+                return self.apply_plan_file(entry['plan_file'])
+            except ProcessException as e:
+                if STALE_PLAN_TEXT not in str(e):
+                    raise
+                self.logger.info('The cached plan is stale, '
+                                 'applying a new plan.')
+            finally:
+                self.remove_cached_plan(entry['key'])
         command = self._tf_command(['apply',
                                     '-auto-approve',
                                     '-no-color',
@@ -464,6 +532,16 @@ class Terraform(CliTool):
         with self.runtime_file(command):
             return self.execute(command)
 
+    def apply_plan_file(self, plan_file_path):
+        # Variables are part of a saved plan, terraform refuses to get them
+        # again.
+        command = self._tf_command(['apply',
+                                    '-auto-approve',
+                                    '-no-color',
+                                    '-input=false'])
+        command.append(plan_file_path)
+        return self.execute(command)
+
     def output(self):
         command = self._tf_command(['output', '-json', '-no-color'])
         output = self.execute(command, False)
@@ -482,7 +560,36 @@ class Terraform(CliTool):
         command = self._tf_command(['graph'])
         return self.execute(command)
 
+    def local_state_path(self):
+        """The state file of the local backend, with its path option and
+        workspaces, or None when the state is stored in a remote backend.
+        """
+        dot_terraform = os.path.join(self.root_module, '.terraform')
+        backend_state = utils.load_json_file(
+            os.path.join(dot_terraform, TERRAFORM_STATE_FILE))
+        backend = backend_state.get('backend') or {}
+        if backend.get('type', 'local') != 'local':
+            return
+        config = backend.get('config') or {}
+        try:
+            with open(os.path.join(dot_terraform, 'environment')) as f:
+                workspace = f.read().strip() or 'default'
+        except (IOError, OSError):
+            workspace = 'default'
+        if workspace != 'default':
+            return os.path.join(self.root_module,
+                                config.get('workspace_dir') or
+                                'terraform.tfstate.d',
+                                workspace,
+                                TERRAFORM_STATE_FILE)
+        return os.path.join(self.root_module,
+                            config.get('path') or TERRAFORM_STATE_FILE)
+
     def state_pull(self):
+        # Pulling local state is just reading the file.
+        local_state_path = self.local_state_path()
+        if local_state_path:
+            return utils.load_json_file(local_state_path) or None
         command = self._tf_command(['state', 'pull'])
         pulled_state = self.execute(command, False)
         # If we got here, then the "state pull" return code must
@@ -543,64 +650,147 @@ class Terraform(CliTool):
         command = self._tf_command(options)
         return self.execute(command)
 
-    def plan_and_show(self):
+    def plan_and_show(self, use_cache=True, refresh=True):
         """
         Execute terraform plan,
         then terraform show on the generated tfplan file
         """
-        with tempfile.NamedTemporaryFile(delete=delete_debug()) as plan_file:
-            self.plan(plan_file.name)
-            return self.show(plan_file.name)
+        return self.cached_plan(use_cache, refresh)['json']
 
-    def plan_and_show_two_formats(self):
+    def plan_and_show_two_formats(self, use_cache=True):
         """
         Execute terraform plan,
         then terraform show on the generated tfplan file
         """
-        with tempfile.NamedTemporaryFile() as plan_file:
-            self.plan(plan_file.name)
-            json_result = self.show(plan_file.name)
-            plain_text_result = self.show_plain_text(plan_file.name)
-            return json_result, plain_text_result
+        entry = self.cached_plan(use_cache)
+        plain_text_result = self.plain_text_plan(
+            entry['json'], entry['plan_file'])
+        return entry['json'], plain_text_result
 
-    def plan_and_show_state(self):
+    @property
+    def plan_cache_dir(self):
+        return os.path.join(self.root_module, PLAN_CACHE_DIR)
+
+    def state_version(self):
+        """The lineage and serial of the local state that a plan is made
+        from. Remote state is not pulled for that, terraform refuses to
+        apply a plan of an older state, and apply makes a new plan then.
         """
-        Execute terraform plan,
-        then terraform show on the generated tfplan file
+        local_state_path = self.local_state_path()
+        if not local_state_path:
+            return
+        state = utils.load_json_file(local_state_path)
+        if not isinstance(state, dict):
+            state = {}
+        return [state.get('lineage'), state.get('serial')]
+
+    def plan_cache_key(self, refresh=True):
+        """Everything that a plan depends on: the module files, the binary,
+        the variables, the environment, the state that it was made from and
+        whether it refreshed that state.
         """
-        status_problems = []
-        with tempfile.NamedTemporaryFile() as plan_file:
-            self.plan(plan_file.name)
-            plan = self.show(plan_file.name)
-            self.refresh()
-            for key, value in plan['planned_values']['root_module'].items():
-                if key == 'resources':
-                    status_problems.extend(
-                        self._show_state_resource_list(value))
-                elif key == 'child_modules':
-                    status_problems.extend(self._show_state_of_modules(value))
-        return status_problems
+        inputs = [
+            utils.get_module_digest(self.root_module),
+            utils.get_file_sha256(self.binary_path),
+            self.insecure_variables,
+            self.insecure_env,
+            self.tfvars,
+            self._flags_override,
+            self.state_version(),
+            refresh,
+        ]
+        return hashlib.sha256(json.dumps(
+            inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get_cached_plan(self, key=None):
+        if not self._plans:
+            return
+        entry = self._plans.get(key or self.plan_cache_key())
+        if entry and os.path.isfile(entry['plan_file']):
+            return entry
+
+    def cached_plan(self, use_cache=True, refresh=True):
+        """Run terraform plan and terraform show, unless we already have
+        the plan for the same inputs. Fresh plans are always cached, so
+        use_cache=False just skips the lookup.
+        Plans are only kept in memory, so they are reused in the operation
+        that made them, and the plan files of earlier operations are
+        removed.
+        """
+        if self._plans is None:
+            self._plans = {}
+            shutil.rmtree(self.plan_cache_dir, ignore_errors=True)
+        key = self.plan_cache_key(refresh)
+        entry = self.get_cached_plan(key) if use_cache else None
+        if entry:
+            self.logger.debug('Reusing the plan {}'.format(
+                entry['plan_file']))
+            return entry
+        utils.mkdir_p(self.plan_cache_dir)
+        plan_file_path = os.path.join(self.plan_cache_dir, key + '.tfplan')
+        self.plan(plan_file_path, refresh)
+        entry = {
+            'key': key,
+            'plan_file': plan_file_path,
+            'json': self.show(plan_file_path),
+        }
+        self._plans.pop(key, None)
+        self._plans[key] = entry
+        self._prune_plan_cache()
+        return entry
+
+    def remove_cached_plan(self, key):
+        entry = (self._plans or {}).pop(key, None)
+        if entry:
+            try:
+                os.remove(entry['plan_file'])
+            except OSError:
+                pass
 
-    def _show_state_of_modules(self, value):
-        status_problems = []
-        for module in value:
-            if not isinstance(module, dict) or 'resources' not in module:
-                continue
-            status_problems.extend(self._show_state_resource_list(
-                module['resources']))
-        return status_problems
+    def _prune_plan_cache(self):
+        for key in list(self._plans)[:-PLAN_CACHE_SIZE]:
+            self.remove_cached_plan(key)
 
-    def _show_state_resource_list(self, value):
-        status_problems = []
-        for resource in value:
+    def plain_text_plan(self, plan_json, plan_file_path):
+        """Render the plain text plan from the JSON plan, unless it's
+        disabled or the plan can't be rendered, then ask terraform show.
+        """
+        if self.render_plain_text_plan:
             try:
-                self.show_state(
-                    resource['address'],
-                    os.path.join(self.root_module, 'terraform.tfstate'))
-            except Exception:
+                return render_plan(plan_json)
+            except Exception as e:
+                self.logger.debug(
+                    'Unable to render the plan, using terraform show: '
+                    '{}'.format(str(e)))
+        return self.show_plain_text(plan_file_path)
+
+    def plan_and_show_state(self):
+        """
+        Execute terraform plan, refresh the state, and then report the
+        planned resources that are missing from the state or tainted.
+        We pull the state once, rather than terraform state show per
+        resource.
+        """
+        plan = self.plan_and_show(use_cache=False)
+        self.refresh()
+        state_index = utils.index_state_resources(self.state_pull())
+        status_problems = []
+        for resource in self._planned_resources(
+                plan['planned_values']['root_module']):
+            address = resource.get('address')
+            if address not in state_index or \
+                    state_index[address].get('status') == 'tainted':
                 status_problems.append(resource)
         return status_problems
 
+    def _planned_resources(self, module):
+        for resource in module.get('resources', []):
+            yield resource
+        for child_module in module.get('child_modules', []):
+            if isinstance(child_module, dict):
+                for resource in self._planned_resources(child_module):
+                    yield resource
+
     def show_state(self, resource_name, plan_file_path=None):
         options = ['state', 'show', '-no-color']
         if plan_file_path:
@@ -635,7 +825,13 @@ class Terraform(CliTool):
             terraform_source = terraform_source.get('location')
         if not os.path.exists(plugins_dir) and utils.is_using_existing():
             utils.mkdir_p(plugins_dir)
-        env_variables = resource_config.get('environment_variables')
+        env_variables = dict(resource_config.get('environment_variables')
+                             or {})
+        plugin_cache_size_limit = resource_config.get(
+            'plugin_cache_size_limit', PLUGIN_CACHE_SIZE_LIMIT)
+        plugin_cache_dir = utils.get_plugin_cache_dir(plugin_cache_size_limit)
+        if plugin_cache_dir:
+            env_variables.setdefault('TF_PLUGIN_CACHE_DIR', plugin_cache_dir)
         terraform_version = ctx.instance.runtime_properties.get(
             'terraform_version', {})
         flags_override = resource_config.get('flags_override')
@@ -653,6 +849,9 @@ class Terraform(CliTool):
             'flags_override': flags_override,
             'log_stdout': resource_config.get('log_stdout', True),
             'tfvars': tfvars_name_file,
+            'render_plain_text_plan': resource_config.get(
+                'render_plain_text_plan', True),
+            'plugin_cache_size_limit': plugin_cache_size_limit,
         }
         for k in key_word_args.keys():
             if k in kwargs and kwargs[k]:
@@ -842,3 +1041,51 @@ def setup_config_tf(ctx,
             tfvars=tf.tfvars)
         ctx.instance.runtime_properties['infracost_config'] = \
             tf.infracost.export_config()
+
+
+def _get_cleaned_flags(help_result):
+    cleaned_flags = []
+    # this will get us the options
+    options = help_result[help_result.find('Options:'):]
+    # clear any default value in flag
+    for flag in re.findall(r"\s+-([^ ]+) .*", options):
+        cleaned_flags.append("--{0}".format(flag.partition('=')[0]))
+    return cleaned_flags
+
+
+def read_help_flags(execute, binary_path, subcommand):
+    """Run terraform <subcommand> -help and return the flags that it accepts.
+    """
+    help_result = execute([binary_path, subcommand, '-help'])
+    cleaned_flags = _get_cleaned_flags(help_result)
+    # check if it has nested_help options
+    help_text_index = help_result.find(NESTED_HELP_TEXT)
+    if not cleaned_flags and help_text_index > -1:
+        nested_help = help_result[help_text_index + len(NESTED_HELP_TEXT):]
+        # replace terraform with correct binary_path
+        help_command = [binary_path]
+        help_command.extend(nested_help.split()[1:])
+        help_result = execute(help_command)
+        for flag in _get_cleaned_flags(help_result):
+            if flag not in cleaned_flags:
+                cleaned_flags.append(flag)
+    return cleaned_flags
+
+
+def get_help_flags(execute, binary_path, subcommand):
+    """The flags of a subcommand only depend on the binary, so we cache them
+    in the shared cache directory by binary sha256 and subcommand.
+    """
+    cache_dir = utils.get_shared_cache_dir('help_flags')
+    if not cache_dir:
+        return read_help_flags(execute, binary_path, subcommand)
+    cache_path = os.path.join(
+        cache_dir, '{}.json'.format(utils.get_file_sha256(binary_path)))
+    cached_flags = utils.load_json_file(cache_path)
+    if subcommand not in cached_flags:
+        flags = read_help_flags(execute, binary_path, subcommand)
+        # Another node instance may have written other subcommands meanwhile.
+        cached_flags = utils.load_json_file(cache_path)
+        cached_flags[subcommand] = flags
+        utils.dump_json_file(cache_path, cached_flags)
+    return cached_flags[subcommand]
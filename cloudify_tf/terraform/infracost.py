@@ -7,9 +7,9 @@ from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
 
 from cloudify.exceptions import RecoverableError
-from cloudify_common_sdk.utils import install_binary
 
 from .tools_base import TFTool, TFToolException
+from .infracost_renderer import render_breakdown
 from ..utils import convert_secrets
 
 
@@ -65,10 +65,7 @@ class Infracost(TFTool):
             self._executable_path = self.__executable_path
         elif self.require_download_infracost(self.__executable_path):
             self._executable_path = self.__executable_path
-            install_binary(self.node_instance_directory,
-                           self._executable_path,
-                           self.installation_source,
-                           'infracost.tar.gz')
+            self.install_tool(self._executable_path, 'infracost.tar.gz')
         return self._executable_path
 
     def require_download_infracost(self, executable_path):
@@ -204,8 +201,6 @@ class Infracost(TFTool):
         remove(f.name)
 
     def infracost(self):
-        result = ''
-        json_result = '{}'
         command = [self.executable_path, 'breakdown', '--config-file']
         with self.runtime_file() as f:
             root_path = str(Path(self.terraform_root_module).resolve())
@@ -219,18 +214,34 @@ class Infracost(TFTool):
                 }]
             }
             with self.config_file() as cf:
-                command.extend([cf, '--show-skipped', '--no-color'])
-                result = self.execute(command, self.terraform_root_module,
-                                      convert_secrets(self.env),
-                                      return_output=True)
-                # injecting the executable_path because execute pops item 0
-                command.insert(0, self.executable_path)
-                command.remove('--show-skipped')
-                command.extend(['--format json'])
-                json_result = self.execute(command, self.terraform_root_module,
-                                           convert_secrets(self.env),
-                                           return_output=True)
-        return result, json.loads(json_result)
+                command.extend([cf, '--no-color', '--format', 'json'])
+                json_result = json.loads(
+                    self.execute(command, self.terraform_root_module,
+                                 convert_secrets(self.env),
+                                 return_output=True) or '{}')
+        return self.plain_text(json_result), json_result
+
+    def plain_text(self, json_result):
+        """The table of the breakdown. If we can't render it, infracost
+        output makes it from the JSON, without terraform or the pricing API.
+        """
+        try:
+            return render_breakdown(json_result)
+        except Exception as e:
+            self.logger.debug(
+                'Unable to render the breakdown, using infracost output: '
+                '{}'.format(str(e)))
+        with NamedTemporaryFile(suffix='.json',
+                                mode='w',
+                                dir=self.terraform_root_module) as f:
+            json.dump(json_result, f)
+            f.flush()
+            return self.execute(
+                [self.executable_path, 'output', '--path', f.name,
+                 '--format', 'table', '--show-skipped', '--no-color'],
+                self.terraform_root_module,
+                convert_secrets(self.env),
+                return_output=True)
 
     def export_config(self):
         return {
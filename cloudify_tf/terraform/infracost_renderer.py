@@ -0,0 +1,192 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Render the cost breakdown table, like infracost breakdown --no-color,
+from the JSON breakdown, so that infracost does not have to run terraform
+and query the pricing API again for the table.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+HEADERS = ('Name', 'Monthly Qty', 'Unit', 'Monthly Cost')
+# The versions of the JSON format that the table is rendered like.
+SUPPORTED_VERSIONS = ('0.1', '0.2')
+CURRENCY_SYMBOLS = {
+    'USD': '$',
+    'EUR': '€',
+    'GBP': '£',
+    'JPY': '¥',
+    'INR': '₹',
+}
+SEPARATOR = '─' * 34
+
+
+class InfracostRenderingError(Exception):
+    pass
+
+
+def _decimal(value):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise InfracostRenderingError('Unexpected number {}'.format(value))
+
+
+def _quantity(value):
+    quantity = _decimal(value)
+    if quantity is None:
+        return ''
+    if quantity == quantity.to_integral_value():
+        return '{:,}'.format(int(quantity))
+    return '{:,.4f}'.format(quantity).rstrip('0').rstrip('.')
+
+
+def _cost(value, currency):
+    cost = _decimal(value)
+    if cost is None:
+        return ''
+    symbol = CURRENCY_SYMBOLS.get(currency, currency + ' ')
+    if 0 < abs(cost) < Decimal('0.01'):
+        return '{}{}'.format(symbol, _quantity(cost))
+    return '{}{:,.2f}'.format(symbol, cost)
+
+
+def _component_row(component, label, currency):
+    if component.get('monthlyCost') is None and \
+            component.get('price') is not None:
+        note = 'Monthly cost depends on usage: {} per {}'.format(
+            _cost(component['price'], currency), component.get('unit', ''))
+        return (label, '', '', ''), note
+    return (label,
+            _quantity(component.get('monthlyQuantity')),
+            component.get('unit') or '',
+            _cost(component.get('monthlyCost'), currency)), None
+
+
+def _tree(item, prefix, currency):
+    """The rows of the cost components and subresources of a resource."""
+    children = [('component', c) for c in item.get('costComponents') or []]
+    children.extend(('resource', r) for r in item.get('subresources') or [])
+    rows = []
+    for index, (kind, child) in enumerate(children):
+        last = index == len(children) - 1
+        label = '{}{}{}'.format(prefix, '└─ ' if last else '├─ ',
+                                child.get('name') or '')
+        if kind == 'component':
+            rows.append(_component_row(child, label, currency))
+        else:
+            rows.append(((label, '', '', ''), None))
+            rows.extend(_tree(child,
+                              prefix + ('   ' if last else '│  '),
+                              currency))
+    return rows
+
+
+def _table(rows):
+    width = [max(len(row[column]) for row, _ in rows if row)
+             for column in range(len(HEADERS))]
+    lines = []
+    for row, note in rows:
+        if row is None:
+            lines.append('')
+            continue
+        if note:
+            lines.append(' {}  {}'.format(row[0].ljust(width[0]), note))
+            continue
+        line = ' {}  {}  {}  {}'.format(row[0].ljust(width[0]),
+                                        row[1].rjust(width[1]),
+                                        row[2].ljust(width[2]),
+                                        row[3].rjust(width[3]))
+        lines.append(line.rstrip())
+    return lines
+
+
+def _resource_counts(counts):
+    return ['  ∙ {} x {}'.format(counts[resource_type], resource_type)
+            for resource_type in sorted(counts)]
+
+
+def _were(count):
+    return '1 was' if count == 1 else '{} were'.format(count)
+
+
+def _summary(summary):
+    detected = summary.get('totalDetectedResources')
+    if detected is None:
+        return []
+    lines = ['{} cloud resource{} detected:'.format(
+        detected, ' was' if detected == 1 else 's were')]
+    estimated = summary.get('totalSupportedResources') or 0
+    usage_based = summary.get('totalUsageBasedResources') or 0
+    free = summary.get('totalNoPriceResources') or 0
+    unsupported = summary.get('totalUnsupportedResources') or 0
+    if estimated:
+        line = '∙ {} estimated'.format(_were(estimated))
+        if usage_based:
+            line += ', {} of which include{} usage-based costs, see ' \
+                    'https://infracost.io/usage-file'.format(
+                        usage_based, 's' if usage_based == 1 else '')
+        lines.append(line)
+    if free:
+        lines.append('∙ {} free:'.format(_were(free)))
+        lines.extend(_resource_counts(
+            summary.get('noPriceResourceCounts') or {}))
+    if unsupported:
+        lines.append(
+            '∙ {} not supported yet, see '
+            'https://infracost.io/requested-resources:'.format(
+                '1 is' if unsupported == 1
+                else '{} are'.format(unsupported)))
+        lines.extend(_resource_counts(
+            summary.get('unsupportedResourceCounts') or {}))
+    return lines
+
+
+def render_breakdown(breakdown_json):
+    """Render the plain text table for the JSON output of
+    infracost breakdown --format json, with the skipped resources.
+    """
+    if not isinstance(breakdown_json, dict) or \
+            not isinstance(breakdown_json.get('projects'), list):
+        raise InfracostRenderingError('Unexpected breakdown format.')
+    if breakdown_json.get('version') not in SUPPORTED_VERSIONS:
+        raise InfracostRenderingError(
+            'Unsupported breakdown version {}.'.format(
+                breakdown_json.get('version')))
+    currency = breakdown_json.get('currency') or 'USD'
+    lines = []
+    for project in breakdown_json['projects']:
+        breakdown = project.get('breakdown') or {}
+        rows = [(HEADERS, None), (None, None)]
+        for resource in breakdown.get('resources') or []:
+            rows.append(((resource.get('name') or '', '', '', ''), None))
+            rows.extend(_tree(resource, '', currency))
+            rows.append((None, None))
+        rows.append((('Project total', '', '',
+                      _cost(breakdown.get('totalMonthlyCost'), currency)),
+                     None))
+        lines.append('Project: {}'.format(project.get('name')))
+        lines.append('')
+        lines.extend(_table(rows))
+        lines.append('')
+    lines.append(' OVERALL TOTAL  {}'.format(
+        _cost(breakdown_json.get('totalMonthlyCost'), currency)))
+    summary = _summary(breakdown_json.get('summary') or {})
+    if summary:
+        lines.append(SEPARATOR)
+        lines.extend(summary)
+    return '\n'.join(lines)
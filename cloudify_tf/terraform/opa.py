@@ -55,12 +55,7 @@ class Opa(TFTool):
             self._executable_path = self.__executable_path
         elif self.require_download_opa(self.__executable_path):
             self._executable_path = self.__executable_path
-            self.install_binary(
-                self.installation_source,
-                self.node_instance_directory,
-                self._executable_path,
-                'opa'
-            )
+            self.install_tool(self._executable_path, 'opa')
         return self._executable_path
 
     def require_download_opa(self, executable_path):
@@ -0,0 +1,273 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Render the human readable plan, like terraform show -no-color,
+from the JSON plan that we already have, so that we don't have to load the
+providers again in another terraform show process.
+"""
+
+import json
+
+INDENT = '    '
+UNKNOWN = '(known after apply)'
+SENSITIVE = '(sensitive value)'
+LEGEND = (
+    'Terraform used the selected providers to generate the following '
+    'execution\nplan. Resource actions are indicated with the following '
+    'symbols:\n')
+NO_CHANGES = (
+    'No changes. Your infrastructure matches the configuration.\n\n'
+    'Terraform has compared your real infrastructure against your '
+    'configuration\nand found no differences, so no changes are needed.')
+
+ACTIONS = {
+    ('create',): ('+', 'will be created', 'create'),
+    ('delete',): ('-', 'will be destroyed', 'destroy'),
+    ('update',): ('~', 'will be updated in-place', 'update in-place'),
+    ('delete', 'create'): (
+        '-/+', 'must be replaced', 'destroy and then create replacement'),
+    ('create', 'delete'): (
+        '+/-', 'must be replaced', 'create replacement and then destroy'),
+    ('read',): ('<=', 'will be read during apply', 'read (data resources)'),
+}
+
+
+class PlanRenderingError(Exception):
+    pass
+
+
+def _action(change):
+    try:
+        return ACTIONS[tuple(change.get('actions', []))]
+    except KeyError:
+        raise PlanRenderingError(
+            'Unsupported actions {}'.format(change.get('actions')))
+
+
+def _scalar(value):
+    if isinstance(value, str) and '\n' not in value:
+        return json.dumps(value)
+    if isinstance(value, str):
+        return '<<-EOT\n{}\nEOT'.format(value)
+    return json.dumps(value)
+
+
+def _marker(unknown, sensitive):
+    if sensitive is True:
+        return SENSITIVE
+    if unknown is True:
+        return UNKNOWN
+    return None
+
+
+def _value(value, unknown, sensitive, prefix):
+    """Render a value that is entirely added or removed."""
+    marker = _marker(unknown, sensitive)
+    if marker:
+        return marker
+    if isinstance(value, dict):
+        lines = ['{']
+        for key in sorted(value):
+            lines.append('{}{}{} = {}'.format(
+                prefix, INDENT, key, _value(
+                    value[key],
+                    _child(unknown, key),
+                    _child(sensitive, key),
+                    prefix + INDENT)))
+        lines.append('{}}}'.format(prefix))
+        return '\n'.join(lines)
+    if isinstance(value, list):
+        if not value:
+            return '[]'
+        lines = ['[']
+        for index, item in enumerate(value):
+            lines.append('{}{}{},'.format(prefix, INDENT, _value(
+                item,
+                _child(unknown, index),
+                _child(sensitive, index),
+                prefix + INDENT)))
+        lines.append('{}]'.format(prefix))
+        return '\n'.join(lines)
+    return _scalar(value)
+
+
+def _child(container, key):
+    if isinstance(container, dict):
+        return container.get(key)
+    if isinstance(container, list) and isinstance(key, int) \
+            and key < len(container):
+        return container[key]
+    return None
+
+
+def _attributes(symbol, values, unknown, sensitive, prefix):
+    lines = []
+    keys = set(values or {})
+    keys.update(k for k, v in (unknown or {}).items() if v is True)
+    width = max([len(k) for k in keys] or [0])
+    for key in sorted(keys):
+        value = (values or {}).get(key)
+        if value is None and _child(unknown, key) is not True:
+            continue
+        rendered = _value(value,
+                          _child(unknown, key),
+                          _child(sensitive, key),
+                          prefix + '  ')
+        if symbol == '-':
+            rendered += ' -> null'
+        lines.append('{}{} {} = {}'.format(
+            prefix, symbol, key.ljust(width), rendered))
+    return lines
+
+
+def _update_attributes(change, prefix):
+    before = change.get('before') or {}
+    after = change.get('after') or {}
+    after_unknown = change.get('after_unknown') or {}
+    before_sensitive = change.get('before_sensitive') or {}
+    after_sensitive = change.get('after_sensitive') or {}
+    keys = set(before) | set(after)
+    keys.update(k for k, v in after_unknown.items() if v is True)
+    width = max([len(k) for k in keys] or [0])
+    lines = []
+    unchanged = 0
+    for key in sorted(keys):
+        old = before.get(key)
+        new = after.get(key)
+        unknown = _child(after_unknown, key)
+        if old == new and not unknown:
+            if old is not None:
+                unchanged += 1
+            continue
+        old_text = _value(old, None, _child(before_sensitive, key),
+                          prefix + '  ')
+        new_text = _value(new, unknown, _child(after_sensitive, key),
+                          prefix + '  ')
+        if old is None:
+            lines.append('{}+ {} = {}'.format(
+                prefix, key.ljust(width), new_text))
+        elif new is None and not unknown:
+            lines.append('{}- {} = {} -> null'.format(
+                prefix, key.ljust(width), old_text))
+        else:
+            lines.append('{}~ {} = {} -> {}'.format(
+                prefix, key.ljust(width), old_text, new_text))
+    if unchanged:
+        lines.append('{}  # ({} unchanged attributes hidden)'.format(
+            prefix, unchanged))
+    return lines
+
+
+def _resource(resource_change):
+    change = resource_change.get('change', {})
+    symbol, description, _ = _action(change)
+    address = resource_change['address']
+    mode = 'data' if resource_change.get('mode') == 'data' else 'resource'
+    lines = ['  # {} {}'.format(address, description)]
+    header = '{} {} "{}" "{}" {{'.format(
+        symbol.rjust(3), mode, resource_change.get('type'),
+        resource_change.get('name'))
+    lines.append(header)
+    prefix = INDENT + '  '
+    if symbol == '+' or symbol == '<=':
+        lines.extend(_attributes('+',
+                                 change.get('after'),
+                                 change.get('after_unknown'),
+                                 change.get('after_sensitive'),
+                                 prefix))
+    elif symbol == '-':
+        lines.extend(_attributes('-',
+                                 change.get('before'),
+                                 None,
+                                 change.get('before_sensitive'),
+                                 prefix))
+    else:
+        lines.extend(_update_attributes(change, prefix))
+    lines.append('    }')
+    return lines
+
+
+def _outputs(output_changes):
+    lines = []
+    for name in sorted(output_changes):
+        change = output_changes[name]
+        if change.get('actions') in [['no-op'], None]:
+            continue
+        symbol, _, _ = _action(change)
+        if symbol == '+':
+            text = _value(change.get('after'),
+                          change.get('after_unknown'),
+                          change.get('after_sensitive'),
+                          '    ')
+        elif symbol == '-':
+            text = '{} -> null'.format(_value(
+                change.get('before'), None,
+                change.get('before_sensitive'), '    '))
+        else:
+            text = '{} -> {}'.format(
+                _value(change.get('before'), None,
+                       change.get('before_sensitive'), '    '),
+                _value(change.get('after'),
+                       change.get('after_unknown'),
+                       change.get('after_sensitive'),
+                       '    '))
+        lines.append('  {} {} = {}'.format(symbol, name, text))
+    return lines
+
+
+def render_plan(plan_json):
+    """Render the plain text plan summary for the JSON representation of a
+    plan, as returned by terraform show -json.
+    """
+    if not isinstance(plan_json, dict):
+        raise PlanRenderingError('Unexpected plan format.')
+    changes = [rc for rc in plan_json.get('resource_changes', [])
+               if rc.get('change', {}).get('actions') != ['no-op']]
+    output_lines = _outputs(plan_json.get('output_changes', {}))
+    if not changes and not output_lines:
+        return NO_CHANGES
+
+    lines = []
+    if changes:
+        used = []
+        for resource_change in changes:
+            action = _action(resource_change['change'])
+            if action not in used:
+                used.append(action)
+        lines.append(LEGEND.rstrip('\n'))
+        for symbol, _, legend in sorted(
+                used, key=lambda a: list(ACTIONS.values()).index(a)):
+            lines.append('{} {}'.format(symbol.rjust(3), legend))
+        lines.append('')
+        lines.append('Terraform will perform the following actions:')
+        add = change = destroy = 0
+        for resource_change in changes:
+            lines.append('')
+            lines.extend(_resource(resource_change))
+            actions = resource_change['change']['actions']
+            if 'create' in actions:
+                add += 1
+            if 'delete' in actions:
+                destroy += 1
+            if actions == ['update']:
+                change += 1
+        lines.append('')
+        lines.append('Plan: {} to add, {} to change, {} to destroy.'.format(
+            add, change, destroy))
+    if output_lines:
+        lines.append('')
+        lines.append('Changes to Outputs:')
+        lines.extend(output_lines)
+    return '\n'.join(lines)
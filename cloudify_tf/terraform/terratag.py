@@ -20,7 +20,6 @@ from os import path
 from time import sleep
 
 from cloudify.exceptions import RecoverableError
-from cloudify_common_sdk.utils import install_binary
 
 from .tools_base import TFTool, TFToolException
 
@@ -87,10 +86,7 @@ class Terratag(TFTool):
             self._executable_path = self.__executable_path
         elif self.require_download_terratag(self.__executable_path):
             self._executable_path = self.__executable_path
-            install_binary(self.node_instance_directory,
-                           self._executable_path,
-                           self.installation_source,
-                           'terratag.tar.gz')
+            self.install_tool(self._executable_path, 'terratag.tar.gz')
         return self._executable_path
 
     def require_download_terratag(self, executable_path):
@@ -0,0 +1,69 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import shutil
+from pytest import fixture
+from tempfile import mkdtemp
+from mock import patch, MagicMock, PropertyMock
+
+from .. import infracost
+from .test_infracost_renderer import BREAKDOWN, TABLE
+
+
+@fixture
+def infracost_obj():
+    obj = infracost.Infracost(MagicMock(),
+                              'foo_deployment',
+                              'foo_instance',
+                              executable_path='/usr/bin/infracost',
+                              variables={'a': 'b'},
+                              environment_variables={'foo': True})
+    obj.terraform_root_module = mkdtemp()
+    yield obj
+    shutil.rmtree(obj.terraform_root_module)
+
+
+@patch('cloudify_tf.terraform.infracost.Infracost.executable_path',
+       new_callable=PropertyMock, return_value='/usr/bin/infracost')
+@patch('cloudify_tf.terraform.infracost.Infracost.execute')
+def test_infracost(mock_execute, _, infracost_obj):
+    mock_execute.return_value = json.dumps(BREAKDOWN)
+    result, json_result = infracost_obj.infracost()
+    # The table is rendered from the only breakdown.
+    mock_execute.assert_called_once()
+    command = mock_execute.call_args[0][0]
+    assert command[:3] == ['/usr/bin/infracost', 'breakdown', '--config-file']
+    assert command[-3:] == ['--no-color', '--format', 'json']
+    assert json_result == BREAKDOWN
+    assert result == TABLE
+
+
+@patch('cloudify_tf.terraform.infracost.Infracost.executable_path',
+       new_callable=PropertyMock, return_value='/usr/bin/infracost')
+@patch('cloudify_tf.terraform.infracost.Infracost.execute')
+def test_infracost_output_fallback(mock_execute, _, infracost_obj):
+    # Unexpected breakdowns, and breakdowns in a format version that we
+    # don't know, are rendered by infracost output.
+    for breakdown in [{'projects': 'unexpected'},
+                      dict(BREAKDOWN, version='0.3')]:
+        mock_execute.side_effect = [json.dumps(breakdown), 'table']
+        result, json_result = infracost_obj.infracost()
+        assert result == 'table'
+        assert json_result == breakdown
+        command = mock_execute.call_args[0][0]
+        assert command[:2] == ['/usr/bin/infracost', 'output']
+        assert command[-4:] == [
+            '--format', 'table', '--show-skipped', '--no-color']
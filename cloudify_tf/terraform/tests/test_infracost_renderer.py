@@ -0,0 +1,165 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pytest import raises
+
+from ..infracost_renderer import (
+    render_breakdown,
+    InfracostRenderingError)
+
+BREAKDOWN = {
+    'version': '0.2',
+    'currency': 'USD',
+    'totalMonthlyCost': '742.64',
+    'projects': [{
+        'name': 'main',
+        'breakdown': {
+            'totalMonthlyCost': '742.64',
+            'resources': [
+                {
+                    'name': 'aws_instance.web_app',
+                    'costComponents': [{
+                        'name': 'Instance usage (Linux/UNIX, on-demand, '
+                                'm5.4xlarge)',
+                        'unit': 'hours',
+                        'monthlyQuantity': '730',
+                        'price': '0.768',
+                        'monthlyCost': '560.64'
+                    }],
+                    'subresources': [
+                        {
+                            'name': 'root_block_device',
+                            'costComponents': [{
+                                'name': 'Storage (general purpose SSD, gp2)',
+                                'unit': 'GB',
+                                'monthlyQuantity': '50',
+                                'price': '0.1',
+                                'monthlyCost': '5'
+                            }]
+                        },
+                        {
+                            'name': 'ebs_block_device[0]',
+                            'costComponents': [
+                                {
+                                    'name': 'Storage (provisioned IOPS SSD, '
+                                            'io1)',
+                                    'unit': 'GB',
+                                    'monthlyQuantity': '1000',
+                                    'price': '0.125',
+                                    'monthlyCost': '125'
+                                },
+                                {
+                                    'name': 'Provisioned IOPS',
+                                    'unit': 'IOPS',
+                                    'monthlyQuantity': '800',
+                                    'price': '0.065',
+                                    'monthlyCost': '52'
+                                }
+                            ]
+                        }
+                    ]
+                },
+                {
+                    'name': 'aws_lambda_function.hello',
+                    'costComponents': [{
+                        'name': 'Requests',
+                        'unit': '1M requests',
+                        'monthlyQuantity': None,
+                        'price': '0.2',
+                        'monthlyCost': None
+                    }]
+                }
+            ]
+        }
+    }],
+    'summary': {
+        'totalDetectedResources': 3,
+        'totalSupportedResources': 2,
+        'totalUsageBasedResources': 1,
+        'totalNoPriceResources': 1,
+        'noPriceResourceCounts': {'aws_iam_role': 1}
+    }
+}
+
+TABLE = '''Project: main
+
+ Name                                                   Monthly Qty  Unit   Monthly Cost
+
+ aws_instance.web_app
+ ├─ Instance usage (Linux/UNIX, on-demand, m5.4xlarge)          730  hours       $560.64
+ ├─ root_block_device
+ │  └─ Storage (general purpose SSD, gp2)                        50  GB            $5.00
+ └─ ebs_block_device[0]
+    ├─ Storage (provisioned IOPS SSD, io1)                    1,000  GB          $125.00
+    └─ Provisioned IOPS                                         800  IOPS         $52.00
+
+ aws_lambda_function.hello
+ └─ Requests                                            Monthly cost depends on usage: $0.20 per 1M requests
+
+ Project total                                                                   $742.64
+
+ OVERALL TOTAL  $742.64
+──────────────────────────────────
+3 cloud resources were detected:
+∙ 2 were estimated, 1 of which includes usage-based costs, see https://infracost.io/usage-file
+∙ 1 was free:
+  ∙ 1 x aws_iam_role'''  # noqa: E501
+
+
+def test_render_breakdown():
+    assert render_breakdown(BREAKDOWN) == TABLE
+
+
+def test_render_empty_breakdown():
+    breakdown = {
+        'version': '0.2',
+        'currency': 'EUR',
+        'totalMonthlyCost': '0',
+        'projects': [{
+            'name': 'main',
+            'breakdown': {'resources': [], 'totalMonthlyCost': '0'}
+        }],
+        'summary': {
+            'totalDetectedResources': 1,
+            'totalUnsupportedResources': 1,
+            'unsupportedResourceCounts': {'aws_foo': 1}
+        }
+    }
+    assert render_breakdown(breakdown).splitlines() == [
+        'Project: main',
+        '',
+        ' Name           Monthly Qty  Unit  Monthly Cost',
+        '',
+        ' Project total                            €0.00',
+        '',
+        ' OVERALL TOTAL  €0.00',
+        '─' * 34,
+        '1 cloud resource was detected:',
+        '∙ 1 is not supported yet, see '
+        'https://infracost.io/requested-resources:',
+        '  ∙ 1 x aws_foo',
+    ]
+
+
+def test_render_unexpected_breakdown():
+    with raises(InfracostRenderingError):
+        render_breakdown({})
+    with raises(InfracostRenderingError):
+        render_breakdown({'version': '0.2', 'projects': [{'breakdown': {
+            'totalMonthlyCost': 'foo'}}]})
+    # Formats that we don't know are left to infracost output.
+    for version in [None, '0.3', '1.0']:
+        with raises(InfracostRenderingError, match='version'):
+            render_breakdown(dict(BREAKDOWN, version=version))
@@ -0,0 +1,108 @@
+########
+# Copyright (c) 2018-2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pytest import raises
+
+from ..plan_renderer import (
+    NO_CHANGES,
+    render_plan,
+    PlanRenderingError)
+
+
+def test_render_no_changes():
+    plan = {
+        'resource_changes': [{
+            'address': 'aws_vpc.example_vpc',
+            'mode': 'managed',
+            'type': 'aws_vpc',
+            'name': 'example_vpc',
+            'change': {'actions': ['no-op']}
+        }],
+        'output_changes': {}
+    }
+    assert render_plan(plan) == NO_CHANGES
+
+
+def test_render_changes():
+    plan = {
+        'resource_changes': [
+            {
+                'address': 'aws_vpc.example_vpc',
+                'mode': 'managed',
+                'type': 'aws_vpc',
+                'name': 'example_vpc',
+                'change': {
+                    'actions': ['create'],
+                    'before': None,
+                    'after': {'cidr_block': '10.10.0.0/16'},
+                    'after_unknown': {'arn': True},
+                    'after_sensitive': {}
+                }
+            },
+            {
+                'address': 'aws_subnet.example_subnet',
+                'mode': 'managed',
+                'type': 'aws_subnet',
+                'name': 'example_subnet',
+                'change': {
+                    'actions': ['update'],
+                    'before': {'cidr_block': '10.10.1.0/24', 'id': 'foo'},
+                    'after': {'cidr_block': '10.10.2.0/24', 'id': 'foo'},
+                    'after_unknown': {},
+                }
+            },
+        ],
+        'output_changes': {
+            'vpc_arn': {
+                'actions': ['create'],
+                'after': None,
+                'after_unknown': True
+            }
+        }
+    }
+    assert render_plan(plan) == '\n'.join([
+        'Terraform used the selected providers to generate the following '
+        'execution',
+        'plan. Resource actions are indicated with the following symbols:',
+        '  + create',
+        '  ~ update in-place',
+        '',
+        'Terraform will perform the following actions:',
+        '',
+        '  # aws_vpc.example_vpc will be created',
+        '  + resource "aws_vpc" "example_vpc" {',
+        '      + arn        = (known after apply)',
+        '      + cidr_block = "10.10.0.0/16"',
+        '    }',
+        '',
+        '  # aws_subnet.example_subnet will be updated in-place',
+        '  ~ resource "aws_subnet" "example_subnet" {',
+        '      ~ cidr_block = "10.10.1.0/24" -> "10.10.2.0/24"',
+        '        # (1 unchanged attributes hidden)',
+        '    }',
+        '',
+        'Plan: 1 to add, 1 to change, 0 to destroy.',
+        '',
+        'Changes to Outputs:',
+        '  + vpc_arn = (known after apply)',
+    ])
+
+
+def test_render_unsupported_plan():
+    with raises(PlanRenderingError):
+        render_plan([{'resource_changes': []}])
+    with raises(PlanRenderingError):
+        render_plan({'resource_changes': [
+            {'address': 'foo.bar', 'change': {'actions': ['forget']}}]})
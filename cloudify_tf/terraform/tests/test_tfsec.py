@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import json
 import shutil
 from pytest import fixture
 from tempfile import mkdtemp
@@ -23,6 +24,7 @@ from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
 
 from .. import tfsec
+from ...binary_store import BinaryStore
 
 TFSEC_URL = 'https://github.com/aquasecurity/tfsec/' \
             'releases/download/v1.1.3/tfsec-linux-amd64'
@@ -95,3 +97,69 @@ def test_validation(sdk_utils_mock, tfsec_params):
     download_file_mock.assert_called_once_with(
         'foo/foo_instance', TFSEC_URL)
     assert tfsec_obj.flags == ['--run-statistics']
+
+
+@patch('cloudify_tf.utils.get_binary_store')
+@patch('cloudify_common_sdk.cli_tool_base.sdk_utils.get_deployment_dir')
+def test_executable_path_from_binary_store(get_deployment_dir_sdk,
+                                           get_binary_store,
+                                           tfsec_params):
+    tenant_dir = mkdtemp()
+    store_dir = mkdtemp()
+    deployment_dir = os.path.join(tenant_dir, 'foo_deployment')
+    get_deployment_dir_sdk.return_value = deployment_dir
+    store = BinaryStore(os.path.join(store_dir, 'binaries'), tenant_dir, 0)
+    get_binary_store.return_value = store
+    downloaded = []
+
+    def download(url):
+        download_path = os.path.join(store_dir, 'a' * 64 + '.zip')
+        with open(download_path, 'wb') as f:
+            f.write(b'#!/bin/sh\n')
+        downloaded.append(url)
+        return download_path
+
+    try:
+        with patch.object(store.downloader, 'download', download):
+            paths = []
+            for node_instance_name in ['foo_instance', 'bar_instance']:
+                tfsec_params['node_instance_name'] = node_instance_name
+                tfsec_obj = tfsec.TFSec(**tfsec_params)
+                paths.append(tfsec_obj.executable_path)
+        assert downloaded == [TFSEC_URL]
+        assert paths[0] == os.path.join(deployment_dir, 'foo_instance',
+                                        'tfsec')
+        assert os.stat(paths[0]).st_ino == os.stat(paths[1]).st_ino
+        assert os.access(paths[1], os.X_OK)
+        ref_path = os.path.join(
+            store_dir, 'binaries', 'refs', 'foo_deployment',
+            'bar_instance.tfsec.json')
+        assert os.path.isfile(ref_path)
+        with patch.object(tfsec_obj, 'validate'):
+            tfsec_obj.uninstall_binary()
+        assert not os.path.exists(paths[1])
+        assert not os.path.exists(ref_path)
+        # Failing to release the binary doesn't fail the uninstall.
+        with patch.object(store, 'release', side_effect=OSError('busy')), \
+                patch.object(tfsec_obj, 'logger') as logger, \
+                patch.object(tfsec_obj, 'validate'):
+            tfsec_obj.uninstall_binary()
+        assert 'busy' in logger.warning.call_args[0][0]
+    finally:
+        shutil.rmtree(tenant_dir)
+        shutil.rmtree(store_dir)
+
+
+def test_configfile_outside_module(tfsec_params):
+    tfsec_params['config'] = {'severity_overrides': {'AWS018': 'LOW'}}
+    tfsec_obj = tfsec.TFSec(**tfsec_params)
+    tfsec_obj.terraform_root_module = mkdtemp()
+    try:
+        with tfsec_obj.configfile() as config_file:
+            assert not config_file.startswith(tfsec_obj.terraform_root_module)
+            with open(config_file) as f:
+                assert json.load(f) == tfsec_params['config']
+        assert not os.path.exists(config_file)
+        assert os.listdir(tfsec_obj.terraform_root_module) == []
+    finally:
+        shutil.rmtree(tfsec_obj.terraform_root_module)
@@ -14,10 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from os import path, remove
+from os import path
+from shutil import rmtree
 from time import sleep
 from contextlib import contextmanager
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 
 from cloudify.exceptions import RecoverableError
 from .tools_base import TFTool, TFToolException
@@ -86,12 +87,7 @@ class TFLint(TFTool):
             self._executable_path = self.__executable_path
         elif self.require_download_tflint(self.__executable_path):
             self._executable_path = self.__executable_path
-            self.install_binary(
-                self.installation_source,
-                self.node_instance_directory,
-                self._executable_path,
-                'tflint.zip'
-            )
+            self.install_tool(self._executable_path, 'tflint.zip')
         return self._executable_path
 
     def require_download_tflint(self, executable_path):
@@ -202,8 +198,9 @@ class TFLint(TFTool):
 
     @contextmanager
     def configfile(self):
-        with NamedTemporaryFile(
-                dir=self.terraform_root_module, delete=False) as tflint_cfg:
+        # Outside of the scanned module, in a directory of its own.
+        config_dir = mkdtemp()
+        with NamedTemporaryFile(dir=config_dir, delete=False) as tflint_cfg:
             tflint_cfg.write(self.config.encode('utf-8'))
             tflint_cfg.flush()
             try:
@@ -214,11 +211,7 @@ class TFLint(TFTool):
                     'troubleshooting {}'.format(tflint_cfg.name))
                 raise TFLintException('Issue running TFLint: {}'.format(
                     str(e)))
-            if path.exists(tflint_cfg.name):
-                try:
-                    remove(tflint_cfg.name)
-                except FileNotFoundError:
-                    pass
+            rmtree(config_dir, ignore_errors=True)
 
     def init(self, variable_file):
         with self.configfile() as tflint_cfg:
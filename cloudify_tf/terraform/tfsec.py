@@ -3,7 +3,7 @@ import shutil
 from os import path
 from time import sleep
 from contextlib import contextmanager
-from tempfile import NamedTemporaryFile
+from tempfile import mkdtemp
 
 from cloudify.exceptions import RecoverableError
 from .tools_base import TFTool, TFToolException
@@ -52,12 +52,7 @@ class TFSec(TFTool):
             self._executable_path = self.__executable_path
         elif self.require_download_tfsec(self.__executable_path):
             self._executable_path = self.__executable_path
-            self.install_binary(
-                self.installation_source,
-                self.node_instance_directory,
-                self._executable_path,
-                'tfsec'
-            )
+            self.install_tool(self._executable_path, 'tfsec')
         return self._executable_path
 
     def require_download_tfsec(self, executable_path):
@@ -156,20 +151,18 @@ class TFSec(TFTool):
 
     @contextmanager
     def configfile(self):
-        with NamedTemporaryFile(mode="w+", delete=False) as f:
-            if self.config:
+        if not self.config:
+            yield
+            return
+        # Outside of the scanned module, in a directory of its own.
+        config_dir = mkdtemp()
+        try:
+            config_file = path.join(config_dir, 'config.json')
+            with open(config_file, 'w') as f:
                 json.dump(self.config, f)
-                f.flush()
-                shutil.move(f.name, self.terraform_root_module+'/config.json')
-                try:
-                    yield 'config.json'
-                except Exception:
-                    raise
-            else:
-                try:
-                    yield
-                except Exception:
-                    raise
+            yield config_file
+        finally:
+            shutil.rmtree(config_dir, ignore_errors=True)
 
     def tfsec(self, command_extension=None):
         with self.configfile() as config_file:
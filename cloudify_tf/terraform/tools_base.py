@@ -18,8 +18,11 @@ import os
 from cloudify.exceptions import NonRecoverableError
 
 from cloudify_common_sdk import hcl
-from cloudify_common_sdk.utils import run_subprocess
 from cloudify_common_sdk.cli_tool_base import CliTool
+from cloudify_common_sdk.utils import run_subprocess, install_binary
+
+from .. import utils
+from ..downloads import DownloadError
 
 
 class TFTool(CliTool):
@@ -27,6 +30,59 @@ class TFTool(CliTool):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    @property
+    def binary_owner(self):
+        return '{}/{}.{}'.format(
+            self._deployment_name, self._node_instance_name, self.tool_name)
+
+    def install_tool(self, executable_path, suffix):
+        """Link the executable from the binary store that the tenant's
+        deployments share, so that every installation source is downloaded
+        once. Without a store, it's downloaded from installation_source to
+        suffix, the name of the file or archive in the node instance
+        directory.
+        """
+        binary_store = utils.get_binary_store() \
+            if self.installation_source else None
+        if not binary_store:
+            if os.path.isfile(executable_path) and \
+                    os.stat(executable_path).st_nlink > 1:
+                # Never write into a file that is linked from the store.
+                os.remove(executable_path)
+            return self._download_tool(executable_path, suffix)
+        try:
+            return binary_store.install(self.installation_source,
+                                        executable_path,
+                                        self.binary_owner,
+                                        suffix)
+        except DownloadError as e:
+            raise TFToolException(
+                'Failed to download {source}: {error}'.format(
+                    source=self.installation_source, error=e))
+
+    def _download_tool(self, executable_path, suffix):
+        if suffix.endswith('.tar.gz'):
+            # CliTool.install_binary only extracts zip archives.
+            return install_binary(self.node_instance_directory,
+                                  executable_path,
+                                  self.installation_source,
+                                  suffix)
+        return self.install_binary(self.installation_source,
+                                   self.node_instance_directory,
+                                   executable_path,
+                                   suffix)
+
+    def uninstall_binary(self):
+        super().uninstall_binary()
+        try:
+            binary_store = utils.get_binary_store()
+            if binary_store:
+                binary_store.release(self.binary_owner)
+        except Exception as e:
+            self.logger.warning(
+                'Failed to release {owner} from the binary store: '
+                '{error}'.format(owner=self.binary_owner, error=e))
+
     @staticmethod
     def convert_config_to_hcl(config):
         new_config_dict = dict()
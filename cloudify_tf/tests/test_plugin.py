@@ -13,11 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from os import path
+import json
+from os import path, listdir
 from mock import (
     patch,
     Mock)
 from tempfile import mkdtemp
+from threading import Barrier
 from contextlib import contextmanager
 
 from cloudify.state import current_ctx
@@ -33,9 +35,14 @@ from ..tasks import (apply,
                      migrate_state,
                      setup_linters,
                      import_resource,
+                     FailedPlanValidation,
+                     FailedPreApplyChecks,
+                     run_pre_apply_checks,
                      set_directory_config)
 from ..utils import RELATIONSHIP_INSTANCE
-from ..terraform import Terraform
+from .._compat import mkdir_p
+from ..terraform import Terraform, get_help_flags
+from ..terraform.tools_base import TFToolException
 
 
 test_dir1 = mkdtemp()
@@ -625,6 +632,34 @@ class TestPlugin(TestBase):
         expected = '-var-file={}'.format(tfvars_mock)
         self.assertTrue(expected in result)
 
+    @patch('cloudify_tf.terraform.delete_debug', return_value=True)
+    @patch('cloudify_tf.terraform.terratag.Terratag.executable_path')
+    @patch('cloudify_tf.terraform.Terraform.set_plugins_dir')
+    @patch('cloudify_tf.terraform.Terraform.version')
+    @patch('cloudify_tf.terraform.utils.get_executable_path')
+    @patch('cloudify_tf.terraform.utils.get_plugins_dir')
+    @patch('cloudify_tf.terraform.utils.get_provider_upgrade')
+    @patch('cloudify_tf.utils.store_sensitive_properties')
+    @patch('cloudify_tf.utils.get_resource_config')
+    def test_runtime_file_outside_module(self, mock_resource_config, *_):
+        mock_resource_config.return_value = {}
+        ctx = self.mock_ctx('test_runtime_file_outside_module', {})
+        current_ctx.set(ctx)
+        tf = Terraform.from_ctx(ctx, 'foo', variables={'a': 'b'})
+        tf.root_module = mkdtemp()
+        # Concurrent checks each get their own file, outside the module.
+        commands = [[], []]
+        with tf.runtime_file(commands[0]), tf.runtime_file(commands[1]):
+            var_files = [command[-1] for command in commands]
+            self.assertNotEqual(var_files[0], var_files[1])
+            for var_file in var_files:
+                self.assertFalse(var_file.startswith(tf.root_module))
+                with open(var_file) as f:
+                    self.assertEqual(json.load(f), {'a': 'b'})
+        self.assertEqual(listdir(tf.root_module), [])
+        for var_file in var_files:
+            self.assertFalse(path.exists(path.dirname(var_file)))
+
     @patch('cloudify_tf.utils._unzip_archive')
     @patch('cloudify_tf.utils.copy_directory')
     @patch('cloudify_tf.utils.get_terraform_state_file', return_value=False)
@@ -742,3 +777,219 @@ class TestPlugin(TestBase):
             '-backend-config="bar=baz"',
             '-migrate-state']
         )
+
+    @patch('cloudify_tf.utils.get_shared_cache_dir')
+    def test_help_flags_cache(self, mock_cache_dir):
+        mock_cache_dir.return_value = mkdtemp()
+        binary_path = path.join(mkdtemp(), 'terraform')
+        with open(binary_path, 'w') as f:
+            f.write('terraform binary')
+        mock_execute = Mock(return_value=(
+            'Usage: terraform [global options] plan [options]\n\n'
+            'Options:\n\n'
+            '  -destroy            Select the "destroy" planning mode.\n'
+            '  -parallelism=n      Limit the number of operations.\n'))
+        flags = get_help_flags(mock_execute, binary_path, 'plan')
+        self.assertEqual(flags, ['--destroy', '--parallelism'])
+        # Another node instance using the same binary reads the cache.
+        self.assertEqual(
+            get_help_flags(mock_execute, binary_path, 'plan'), flags)
+        mock_execute.assert_called_once_with([binary_path, 'plan', '-help'])
+
+    @patch('cloudify_tf.terraform.Terraform.show_plain_text')
+    @patch('cloudify_tf.terraform.Terraform.show')
+    @patch('cloudify_tf.terraform.Terraform.plan')
+    def test_plan_and_show_two_formats(self, mock_plan, mock_show,
+                                       mock_show_plain_text):
+        mock_show.return_value = {'resource_changes': []}
+        binary_path = path.join(mkdtemp(), 'terraform')
+        with open(binary_path, 'w') as f:
+            f.write('terraform binary')
+        # When it's disabled, terraform show renders the plan.
+        tf = Terraform(Mock(), binary_path, mkdtemp(), mkdtemp(),
+                       environment_variables={},
+                       render_plain_text_plan=False)
+        tf.plan_and_show_two_formats()
+        mock_show_plain_text.assert_called_once()
+        mock_show_plain_text.reset_mock()
+        tf = Terraform(Mock(), binary_path, mkdtemp(), mkdtemp(),
+                       environment_variables={})
+        json_result, plain_text_result = tf.plan_and_show_two_formats()
+        self.assertEqual(json_result, {'resource_changes': []})
+        self.assertIn('No changes.', plain_text_result)
+        mock_show_plain_text.assert_not_called()
+        # A plan that can't be rendered falls back to terraform show.
+        mock_show.return_value = [{'resource_changes': []}]
+        tf.plan_and_show_two_formats(use_cache=False)
+        mock_show_plain_text.assert_called_once()
+
+    @patch('cloudify_tf.terraform.Terraform.execute')
+    @patch('cloudify_tf.terraform.Terraform.refresh')
+    @patch('cloudify_tf.terraform.Terraform.state_pull')
+    @patch('cloudify_tf.terraform.Terraform.plan_and_show')
+    def test_plan_and_show_state(self, mock_plan_and_show, mock_state_pull,
+                                 mock_refresh, mock_execute):
+        mock_plan_and_show.return_value = {'planned_values': {'root_module': {
+            'resources': [{'address': 'aws_vpc.a'},
+                          {'address': 'aws_vpc.b'}],
+            'child_modules': [{'resources': [
+                {'address': 'module.m.aws_subnet.c[0]'}]}]}}}
+        mock_state_pull.return_value = {'resources': [
+            {'mode': 'managed', 'type': 'aws_vpc', 'name': 'a',
+             'instances': [{}]},
+            {'module': 'module.m', 'mode': 'managed', 'type': 'aws_subnet',
+             'name': 'c', 'instances': [{'index_key': 0,
+                                         'status': 'tainted'}]}]}
+        tf = Terraform(Mock(), 'terraform', mkdtemp(), mkdtemp(),
+                       environment_variables={})
+        self.assertEqual(tf.plan_and_show_state(),
+                         [{'address': 'aws_vpc.b'},
+                          {'address': 'module.m.aws_subnet.c[0]'}])
+        mock_state_pull.assert_called_once()
+        mock_execute.assert_not_called()
+
+    @patch('cloudify_tf.terraform.Terraform.execute')
+    def test_state_pull_local_backend(self, mock_execute):
+        root_module = mkdtemp()
+        tf = Terraform(Mock(), 'terraform', mkdtemp(), root_module,
+                       environment_variables={})
+        with open(path.join(root_module, 'terraform.tfstate'), 'w') as f:
+            f.write('{"serial": 3}')
+        self.assertEqual(tf.state_pull(), {'serial': 3})
+        mock_execute.assert_not_called()
+        mkdir_p(path.join(root_module, '.terraform'))
+        with open(path.join(
+                root_module, '.terraform', 'terraform.tfstate'), 'w') as f:
+            f.write('{"backend": {"type": "s3"}}')
+        mock_execute.return_value = '{"serial": 4}'
+        self.assertEqual(tf.state_pull(), {'serial': 4})
+
+    @patch('cloudify_tf.terraform.Terraform.execute')
+    def test_init_fingerprint(self, mock_execute):
+        binary_path = path.join(mkdtemp(), 'terraform')
+        with open(binary_path, 'w') as f:
+            f.write('terraform binary')
+        root_module = mkdtemp()
+        with open(path.join(root_module, 'main.tf'), 'w') as f:
+            f.write('resource "null_resource" "a" {}')
+        mock_execute.side_effect = lambda *_: mkdir_p(
+            path.join(root_module, '.terraform'))
+        tf = Terraform(Mock(), binary_path, mkdtemp(), root_module,
+                       environment_variables={},
+                       additional_args={})
+        tf.init()
+        tf.init()
+        self.assertEqual(mock_execute.call_count, 1)
+        # Changing the configuration or upgrading providers runs init.
+        with open(path.join(root_module, 'versions.tf.json'), 'w') as f:
+            f.write('{}')
+        tf.init()
+        self.assertEqual(mock_execute.call_count, 2)
+        tf.provider_upgrade = True
+        tf.init()
+        self.assertEqual(mock_execute.call_count, 3)
+
+    @patch('cloudify_tf.terraform.Terraform.execute')
+    @patch('cloudify_tf.terraform.Terraform.show')
+    @patch('cloudify_tf.terraform.Terraform.plan')
+    def test_plan_cache(self, mock_plan, mock_show, mock_execute):
+        current_ctx.set(self.mock_ctx('test_plan_cache', {}))
+        mock_show.return_value = {'resource_changes': []}
+        binary_path = path.join(mkdtemp(), 'terraform')
+        with open(binary_path, 'w') as f:
+            f.write('terraform binary')
+        root_module = mkdtemp()
+        with open(path.join(root_module, 'main.tf'), 'w') as f:
+            f.write('resource "null_resource" "a" {}')
+        mock_plan.side_effect = lambda plan_file, *_: open(
+            plan_file, 'w').close()
+        tf = Terraform(Mock(), binary_path, mkdtemp(), root_module,
+                       variables={'a': 'b'},
+                       environment_variables={},
+                       additional_args={})
+        # The OPA policy and the apply reuse the plan.
+        tf.plan_and_show()
+        tf.plan_and_show_two_formats()
+        self.assertEqual(mock_plan.call_count, 1)
+        plan_file = mock_plan.call_args[0][0]
+        tf.apply()
+        self.assertEqual(mock_execute.call_args[0][0][-1], plan_file)
+        self.assertIsNone(tf.get_cached_plan())
+        # Changing the module or the variables makes a new plan.
+        tf.plan_and_show()
+        with open(path.join(root_module, 'main.tf'), 'a') as f:
+            f.write('\n')
+        tf.plan_and_show()
+        tf.variables = {'a': 'c'}
+        tf.plan_and_show()
+        self.assertEqual(mock_plan.call_count, 4)
+        # Any file of the module may be read by file() or templatefile().
+        with open(path.join(root_module, 'config.json'), 'w') as f:
+            f.write('{}')
+        tf.plan_and_show()
+        self.assertEqual(mock_plan.call_count, 5)
+        # What the plugin and terraform write next to the module does not.
+        for name in ['.terraform_init_fingerprint.json', 'terraform.tfstate']:
+            with open(path.join(root_module, name), 'w') as f:
+                f.write('{}')
+        tf.plan_and_show()
+        self.assertEqual(mock_plan.call_count, 5)
+        # Plans without a refresh are not reused or applied.
+        tf.plan_and_show(refresh=False)
+        self.assertEqual(mock_plan.call_count, 6)
+        tf.plan_and_show()
+        self.assertEqual(mock_plan.call_count, 6)
+        tf.plan_and_show(refresh=False)
+        self.assertEqual(mock_plan.call_count, 6)
+        # Plans of other operations, e.g. terraform_plan, are not applied,
+        # and their files are removed.
+        plan_file = mock_plan.call_args[0][0]
+        self.assertTrue(path.isfile(plan_file))
+        tf = Terraform(Mock(), binary_path, mkdtemp(), root_module,
+                       variables={'a': 'c'},
+                       environment_variables={},
+                       additional_args={})
+        tf.apply()
+        self.assertNotIn(plan_file, mock_execute.call_args[0][0])
+        tf.plan_and_show()
+        self.assertEqual(mock_plan.call_count, 7)
+        self.assertFalse(path.isfile(plan_file))
+        # Remote state is not pulled for the plan key.
+        mock_execute.reset_mock()
+        with patch('cloudify_tf.terraform.Terraform.local_state_path',
+                   return_value=None):
+            tf.plan_and_show()
+        mock_execute.assert_not_called()
+
+    def test_run_pre_apply_checks(self):
+        ctx = self.mock_ctx('test_run_pre_apply_checks', {})
+        current_ctx.set(ctx=ctx)
+        old_plan = {'resource_changes': [{'address': 'a'}]}
+        tf = Mock()
+        tf.plan_and_show.return_value = old_plan
+        run_pre_apply_checks(tf, old_plan)
+        tf.check_tflint.assert_called_once()
+        tf.check_tfsec.assert_called_once()
+        # A failed check raises its own error.
+        tf.plan_and_show.return_value = {'resource_changes': []}
+        with self.assertRaises(FailedPlanValidation):
+            run_pre_apply_checks(tf, old_plan)
+        # Failed checks are raised together.
+        started = Barrier(2)
+
+        def check_tflint():
+            started.wait(5)
+            raise TFToolException('tflint failed')
+
+        def plan_and_show():
+            started.wait(5)
+            return {'resource_changes': []}
+
+        tf.check_tflint.side_effect = check_tflint
+        tf.plan_and_show.side_effect = plan_and_show
+        tf.tfsec = None
+        with self.assertRaises(FailedPreApplyChecks) as e:
+            run_pre_apply_checks(tf, old_plan)
+        self.assertIn('tflint failed', str(e.exception))
+        self.assertIn('differs from the old plan', str(e.exception))
+        self.assertEqual(len(e.exception.causes), 2)
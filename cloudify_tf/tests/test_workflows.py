@@ -40,20 +40,44 @@ class TFWorkflowTests(TestCase):
         context.relationships = [relationship]
         return context
 
-    @staticmethod
-    def _mock_sequence():
-        sequence = MagicMock()
-        sequence.add.return_value = None
-        return sequence
-
     def test_plan_module_instance(self):
         ctx = MockContext()
         current_ctx.set(ctx)
         node = self._mock_node_context()
         instance = self._mock_instance_context()
-        sequence = self._mock_sequence()
-        workflows._plan_module_instance(ctx, node, instance, sequence, {})
-        assert sequence.add.call_count == 4
+        hosts = {}
+        tasks, host_ids = workflows._plan_module_instance(
+            ctx, node, instance, hosts, {})
+        # Only the plan, which waits for the host to be started.
+        assert len(tasks) == 1
+        assert host_ids == list(hosts)
+        # Another node instance on the same host is added to its
+        # relationships, so that the host is started once.
+        other_instance = self._mock_instance_context()
+        other_instance.relationships[0].target_node_instance = \
+            instance.relationships[0].target_node_instance
+        tasks, other_host_ids = workflows._plan_module_instance(
+            ctx, node, other_instance, hosts, {})
+        assert len(tasks) == 1
+        assert other_host_ids == host_ids
+        relationships = hosts[host_ids[0]]
+        assert relationships == [instance.relationships[0],
+                                 other_instance.relationships[0]]
+        # The host is created, then preconfigured, then started.
+        graph = MagicMock()
+        host_instance = relationships[0].target_node_instance
+        started = workflows._start_terraform_instance(graph, relationships)
+        assert started == host_instance.set_state.return_value
+        added = [c[0][0] for c in
+                 graph.sequence.return_value.add.call_args_list]
+        assert added == [
+            host_instance.execute_operation.return_value,
+            relationships[0].execute_source_operation.return_value,
+            relationships[1].execute_source_operation.return_value,
+            started]
+        host_instance.execute_operation.assert_called_once_with(
+            workflows.CREATE)
+        host_instance.set_state.assert_called_once_with('started')
 
     def test_migrate_state(self):
         ctx = MockedWorkflowCtx()
@@ -105,3 +129,57 @@ class TFWorkflowTests(TestCase):
                 node_instances,
                 **kwargs
             )
+
+    @staticmethod
+    def _mock_module_instance(instance_id, target_ids=None):
+        instance = MagicMock()
+        instance.id = instance_id
+        instance.node.type_hierarchy = ['cloudify.nodes.terraform.Module']
+        instance.relationships = [MagicMock(target_id=target_id)
+                                  for target_id in target_ids or []]
+        instance.execute_operation.return_value = MagicMock(
+            instance_id=instance_id)
+        return instance
+
+    @staticmethod
+    def _added(graph):
+        return [task.instance_id for c in
+                graph.sequence.return_value.add.call_args_list
+                for task in c[0]]
+
+    @staticmethod
+    def _succeed(graph, instance_id):
+        for c in graph.sequence.return_value.add.call_args_list:
+            if c[0][-1].instance_id == instance_id:
+                return c[0][-1].on_success(c[0][-1])
+
+    def test_terraform_operation_concurrency(self):
+        ctx = MagicMock()
+        # d depends on a and c, c depends on b.
+        ctx.node_instances = [
+            self._mock_module_instance('d', ['a', 'c']),
+            self._mock_module_instance('c', ['b']),
+            self._mock_module_instance('a'),
+            self._mock_module_instance('b'),
+            self._mock_module_instance('e'),
+        ]
+        graph = workflows._terraform_operation(
+            ctx, 'terraform.refresh', [], [], max_concurrency=2)
+        # Only ready instances are started, up to the limit.
+        self.assertEqual(self._added(graph), ['a', 'b'])
+        # a is done, but c and d are not ready, so e takes the slot.
+        self._succeed(graph, 'a')
+        self.assertEqual(self._added(graph), ['a', 'b', 'e'])
+        self._succeed(graph, 'b')
+        self.assertEqual(self._added(graph), ['a', 'b', 'e', 'c'])
+        # d waits for c, not for the instances before it.
+        self._succeed(graph, 'c')
+        self.assertEqual(self._added(graph), ['a', 'b', 'e', 'c', 'd'])
+        graph.add_dependency.assert_not_called()
+        # Without a limit, every ready instance starts at once.
+        ctx.graph_mode.return_value = MagicMock()
+        graph = workflows._terraform_operation(
+            ctx, 'terraform.refresh', [], [], max_concurrency=0)
+        self.assertEqual(self._added(graph), ['a', 'b', 'e'])
+        self._succeed(graph, 'b')
+        self.assertEqual(self._added(graph), ['a', 'b', 'e', 'c'])
@@ -14,25 +14,37 @@
 # limitations under the License.
 
 import os
+import re
 import sys
+import glob
 import json
+import stat
 import base64
-import ntpath
+import binascii
 import shutil
+import hashlib
+import zlib
 import zipfile
 import filecmp
 import tempfile
+import time
 
 import requests
 import threading
-from io import BytesIO
 from copy import deepcopy
 from textwrap import indent
 from itertools import islice
 from contextlib import contextmanager
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ThreadPoolExecutor,
+    wait as wait_futures,
+)
 
 from pathlib import Path
+from urllib.parse import urlparse
 from cloudify import ctx
+from cloudify.state import current_ctx, NotInContext
 from cloudify.exceptions import NonRecoverableError, RecoverableError
 from cloudify.utils import exception_to_error_cause
 from cloudify_common_sdk.hcl import (
@@ -43,11 +55,12 @@ from cloudify_common_sdk.hcl import (
 from cloudify_common_sdk.utils import (
     v1_gteq_v2,
     get_ctx_node,
-    download_file,
+    install_binary,
     copy_directory,
     CommonSDKSecret,
     get_ctx_instance,
     find_rel_by_type,
+    get_deployment_dir,
     with_rest_client,
     get_cloudify_version,
     get_node_instance_dir,
@@ -74,9 +87,37 @@ from .constants import (
     STATE,
     DRIFTS,
     IS_DRIFTED,
-    TERRAFORM_STATE_FILE
+    CHUNK_SIZE,
+    PLAN_CACHE_DIR,
+    PLUGIN_CACHE_DIR,
+    SHARED_CACHE_DIR,
+    BINARY_STORE_DIR,
+    SOURCE_SYNC_FILE,
+    SOURCE_STORE_DIR,
+    TREE_DEPTH_LIMIT,
+    TREE_EXCLUDE_DIRS,
+    TREE_LENGTH_LIMIT,
+    URL_PROBE_TIMEOUT,
+    TERRAFORM_STATE_FILE,
+    PROVIDERS_INDEX_FILE,
+    MODULE_DIGEST_EXCLUDE,
+    INIT_FINGERPRINT_FILE,
+    PLUGIN_CACHE_LOCK_FILE,
+    PROVIDER_DOWNLOADS_DIR,
+    BINARY_STORE_SIZE_LIMIT,
+    PLUGIN_CACHE_USAGE_FILE,
+    REMOTE_SOURCE_CACHE_DIR,
+    PROVIDER_PACKAGE_PATTERN,
+    PLUGIN_CACHE_GRACE_PERIOD,
+    PROVIDER_DOWNLOADS_SIZE_LIMIT,
+    REMOTE_SOURCE_CACHE_SIZE_LIMIT
 )
 from ._compat import text_type, StringIO, mkdir_p
+from .archive import ArchiveWriter, get_compression_level
+from .binary_store import BinaryStore, file_lock
+from .downloads import Downloader, DownloadError
+from .source_cache import RemoteSourceCache
+from .source_store import LocalSourceStore
 
 
 def convert_secrets(data):
@@ -97,42 +138,57 @@ def convert_secrets(data):
     return recurse(deepcopy(data))
 
 
-def exclude_file(dirname, filename, excluded_files):
-    """In _zip_archive, we need to prevent certain files, i.e. the TF binary,
-    from being added  to the zip. It's totally unnecessary,
+class ExclusionMatcher(object):
+    """In _zip_archive, we need to prevent certain files, i.e. the TF binary
+    and plugins, from being added to the zip. It's totally unnecessary,
     and also crashes the manager.
-    """
-    rel_path = os.path.join(dirname, filename)
-    for f in excluded_files:
-        if not f:
-            continue
-        elif os.path.isfile(f) and rel_path == f:
-            return True
-        elif os.path.isdir(f) and f in rel_path:
-            return True
-    return False
 
-
-def exclude_dirs(dirname, subdirs, excluded_files):
-    """In _zip_archive, we need to prevent certain files, i.e. TF plugins,
-    from being added  to the zip. It's totally unnecessary,
-    and also crashes the manager.
+    The excluded files and directories are resolved once into a trie of
+    path components, which the walk descends together with the directories.
     """
-    rel_subdirs = [os.path.join(dirname, d) for d in subdirs]
-    for f in excluded_files:
-        if not f:
-            continue
-        if os.path.isdir(f) and f in rel_subdirs:
-            try:
-                subdirs.remove(ntpath.basename(f))
-            except ValueError:
-                pass
-
 
-def file_storage_breaker(filepath):
-    filesize = Path(filepath).stat().st_size
+    def __init__(self, excluded_files):
+        self.root = {}
+        for f in excluded_files or []:
+            if not f or not os.path.exists(f):
+                continue
+            node = self.root
+            for part in self.split(f):
+                node = node.setdefault(part, {})
+                if None in node:
+                    break
+            else:
+                # Everything under an excluded directory is excluded.
+                node.clear()
+                node[None] = True
+
+    @staticmethod
+    def split(path):
+        return os.path.normpath(os.path.abspath(path)).split(os.sep)[1:]
+
+    def node(self, path):
+        """The trie node of a directory, or None if nothing under it is
+        excluded. A node with the None key is excluded.
+        """
+        node = self.root
+        for part in self.split(path):
+            node = node.get(part)
+            if node is None or None in node:
+                return node
+        return node
+
+    def excluded(self, path):
+        node = self.node(path)
+        return node is not None and None in node
+
+
+def file_storage_breaker(filepath, filesize=None, properties=None):
+    if filesize is None:
+        filesize = Path(filepath).stat().st_size
     if filesize > 50000:
-        max_stored_filesize = get_ctx_node().properties.get(
+        properties = get_ctx_node().properties if properties is None \
+            else properties
+        max_stored_filesize = properties.get(
             'max_stored_filesize', 500000)
         if filesize >= max_stored_filesize:
             ctx.logger.warn(
@@ -141,7 +197,9 @@ def file_storage_breaker(filepath):
                 .format(f=filepath, s=filesize, m=max_stored_filesize))
             return True
     elif '.terraform/plugins' in filepath:
-        store_plugins_dir = get_ctx_node().properties.get(
+        properties = get_ctx_node().properties if properties is None \
+            else properties
+        store_plugins_dir = properties.get(
             'store_plugins_dir', False)
         if not store_plugins_dir:
             ctx.logger.warn(
@@ -151,40 +209,79 @@ def file_storage_breaker(filepath):
     return False
 
 
-def _zip_archive(extracted_source, exclude_files=None, **_):
+def _walk_archive_files(dir_path, node):
+    """Yield the DirEntry of every file under dir_path, in a stable order,
+    that the exclusion trie node does not exclude. Links to directories are
+    not followed.
+    """
+    with os.scandir(dir_path) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    subdirs = []
+    for entry in entries:
+        child = node.get(entry.name) if node else None
+        if child is not None and None in child:
+            continue
+        if entry.is_dir():
+            if not entry.is_symlink():
+                subdirs.append((entry, child))
+        else:
+            yield entry
+    for entry, child in subdirs:
+        for file_entry in _walk_archive_files(entry.path, child):
+            yield file_entry
+
+
+def _zip_archive(extracted_source, exclude_files=None, manifest=None, **_):
     """Zip up a folder and all its sub-folders,
     except for those that we wish to exclude.
+    The archive is the same for the same files, regardless of their
+    timestamps, so that it can be content addressed.
 
     :param extracted_source: The location.
     :param exclude_files: A list of files and directories, that we don't
     want to put in the zip.
+    :param manifest: A list, that we add [path, size, sha256] to for
+    every archived file.
     :param _:
     :return:
     """
     ctx.logger.debug("Zipping source {source}".format(source=extracted_source))
     exclude_files = exclude_files or []
     ctx.logger.debug('Excluding files {l}'.format(l=exclude_files))
+    matcher = ExclusionMatcher(exclude_files)
+    properties = get_ctx_node().properties
+    try:
+        compression_level = get_compression_level(
+            properties.get('archive_compression_level'))
+    except ValueError as e:
+        raise NonRecoverableError(
+            'Invalid archive_compression_level: {}'.format(e))
+
+    def archive_files():
+        if matcher.excluded(extracted_source):
+            return
+        for entry in _walk_archive_files(
+                extracted_source, matcher.node(extracted_source)):
+            try:
+                file_stat = entry.stat()
+            except OSError:
+                ctx.logger.debug('Not archiving the broken link {}.'.format(
+                    entry.path))
+                continue
+            if file_storage_breaker(entry.path,
+                                    file_stat.st_size,
+                                    properties):
+                continue
+            # The name of the file in the archive.
+            yield entry.path, entry.path[len(extracted_source)+1:], file_stat
+
     with tempfile.NamedTemporaryFile(suffix=".zip",
                                      delete=False) as updated_zip:
         updated_zip.close()
-        with zipfile.ZipFile(updated_zip.name,
-                             mode='w',
-                             compression=zipfile.ZIP_DEFLATED) as output_file:
-            for dir_name, subdirs, filenames in os.walk(extracted_source):
-                # Make sure that the files that we don't want
-                # to include (e.g. plugins directory) will not be archived.
-                exclude_dirs(dir_name, subdirs, exclude_files)
-                for filename in filenames:
-                    # Extra layer of validation on the excluded files.
-                    if not exclude_file(dir_name, filename, exclude_files):
-                        # Create the path as we want to archive it to the
-                        # archivee.
-                        file_to_add = os.path.join(dir_name, filename)
-                        # The name of the file in the archive.
-                        if file_storage_breaker(file_to_add):
-                            continue
-                        arc_name = file_to_add[len(extracted_source)+1:]
-                        output_file.write(file_to_add, arcname=arc_name)
+        entries = ArchiveWriter(
+            updated_zip.name, compression_level).write(archive_files())
+        if manifest is not None:
+            manifest.extend(entries)
         archive_file_path = updated_zip.name
     return archive_file_path
 
@@ -194,33 +291,188 @@ def _unzip_archive(archive_path, target_directory, source_path=None, **_):
     Unzip a zip archive.
     """
 
-    # Create a temporary directory.
-    # Create a zip archive object.
-    # Extract the object.
+    # Extract every member straight to its path in the target directory,
+    # and skip the files that already have the same size and CRC.
     ctx.logger.debug('Unzipping {src} to {dst}.'.format(
         src=archive_path, dst=target_directory))
 
-    src = unzip_archive(archive_path, skip_parent_directory=False)
-    copy_directory(src, target_directory)
-    remove_dir(src)
+    target_directory = os.path.abspath(target_directory)
+    mkdir_p(target_directory)
+    with zipfile.ZipFile(archive_path, 'r') as zip_file:
+        for zip_info in zip_file.infolist():
+            target_path = os.path.normpath(
+                os.path.join(target_directory, zip_info.filename))
+            if not target_path.startswith(target_directory + os.sep):
+                raise NonRecoverableError(
+                    'The archive member {name} is outside of the target '
+                    'directory.'.format(name=zip_info.filename))
+            mode = stat.S_IMODE(zip_info.external_attr >> 16)
+            if zip_info.is_dir():
+                mkdir_p(target_path)
+            elif _is_same_file(zip_info, target_path):
+                if mode and stat.S_IMODE(os.stat(target_path).st_mode) != mode:
+                    os.chmod(target_path, mode)
+            else:
+                _extract_member(zip_file, zip_info, target_path)
     return target_directory
 
 
+def _extract_member(zip_file, zip_info, target_path):
+    """Extract one file of an archive through a temporary file, so that
+    readers never see a partial file, and keep its permissions.
+    """
+    target_dir = os.path.dirname(target_path)
+    mkdir_p(target_dir)
+    with tempfile.NamedTemporaryFile(dir=target_dir, delete=False) as dst:
+        with zip_file.open(zip_info) as src:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    # Temporary files are only readable by their owner, so archives without
+    # permissions get the usual default.
+    os.chmod(dst.name, stat.S_IMODE(zip_info.external_attr >> 16) or 0o644)
+    os.replace(dst.name, target_path)
+
+
+def _is_same_file(zip_info, file_path):
+    """Whether file_path has the content of the zip_info member."""
+    try:
+        if os.path.getsize(file_path) != zip_info.file_size:
+            return False
+        crc = 0
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+    except OSError:
+        return False
+    return crc == zip_info.CRC
+
+
 def clean_strings(string):
     if isinstance(string, text_type):
         return string.encode('utf-8').rstrip("'").lstrip("'")
     return string
 
 
+# Whole lines of base64.encode output, 57 bytes each, so that the chunks
+# concatenate to the same text.
+BASE64_CHUNK_SIZE = CHUNK_SIZE // 57 * 57
+
+
+def get_base64_size(file_path):
+    """The length of the base64 text of a file, without encoding it."""
+    size = os.path.getsize(file_path)
+    lines = (size + 56) // 57
+    return (size + 2) // 3 * 4 + lines
+
+
 def _file_to_base64(file_path):
     # By getting here, "terraform_source_zip" is the path to a ZIP
     # file containing the Terraform files.
     # We need to encode the contents of the file and set them
-    # as a runtime property.
-    base64_rep = BytesIO()
+    # as a runtime property. Encode it chunk by chunk, and keep the chunks
+    # as a list in the runtime property, so that the text is never joined
+    # into one string, neither here nor when it's decoded.
     with open(file_path, 'rb') as f:
-        base64.encode(f, base64_rep)
-    return base64_rep.getvalue().decode('utf-8')
+        return [base64.encodebytes(chunk).decode('ascii')
+                for chunk in iter(lambda: f.read(BASE64_CHUNK_SIZE), b'')]
+
+
+def _base64_chunks(material):
+    """The chunks of base64 material: a list of chunks, or text written by
+    older versions, which is sliced.
+    """
+    if isinstance(material, list):
+        return material
+    return (material[start:start + CHUNK_SIZE]
+            for start in range(0, len(material), CHUNK_SIZE))
+
+
+def _base64_to_file(material, f):
+    """Decode base64 material into a file object chunk by chunk."""
+    remainder = ''
+    for chunk in _base64_chunks(material):
+        chunk = remainder + ''.join(chunk.split())
+        end = len(chunk) // 4 * 4
+        f.write(base64.b64decode(chunk[:end]))
+        remainder = chunk[end:]
+    if remainder:
+        raise NonRecoverableError(
+            'The terraform source is not valid base64.')
+
+
+def get_source_store():
+    """The store for terraform_source archives, or None if there isn't a
+    directory that all the deployments of the tenant share.
+    """
+    store_dir = get_shared_cache_dir(SOURCE_STORE_DIR)
+    if store_dir:
+        return LocalSourceStore(
+            store_dir, os.path.dirname(os.path.dirname(store_dir)))
+
+
+def _store_source_archive(archive_path, manifest, target=False,
+                          max_size=None):
+    """Put the archive in the source store and return the material for the
+    terraform_source runtime property: the digest and the manifest of the
+    archive, or the base64 of the archive if there is no store.
+    """
+    store = get_source_store()
+    if not store:
+        size = get_base64_size(archive_path)
+        ctx.logger.warn('The after base64_rep size is {size}.'.format(
+            size=size))
+        if max_size is not None and size > max_size:
+            raise Exception('Not storing terraform_source, '
+                            'because its size is {}'.format(size))
+        return _file_to_base64(archive_path)
+    owner = '{}/{}'.format(ctx.deployment.id,
+                           get_ctx_instance(target=target).id)
+    return {
+        'digest': store.put(archive_path, owner),
+        'manifest': manifest,
+    }
+
+
+def _stored_source_archive(material):
+    store = get_source_store()
+    if store:
+        return store.get(material['digest'])
+
+
+@contextmanager
+def source_archive(material):
+    """Yield the path of the zip archive of terraform_source material,
+    which is either a digest in the source store or base64. When the store
+    lost the archive, the source is downloaded again from resource_config.
+    None is yielded when there is no archive, like on Cloudify 6.0 and up
+    where the material is not stored.
+    """
+    if isinstance(material, dict):
+        archive_path = _stored_source_archive(material)
+        if not archive_path:
+            ctx.logger.warn(
+                'The terraform source {} is missing from the source '
+                'store, getting it again from resource_config.source. '
+                'The files that operations added to the module, like '
+                'the state file, are not restored.'.format(
+                    material['digest']))
+            material = update_terraform_source_material(
+                get_resource_config().get('source'))
+            if isinstance(material, dict):
+                archive_path = _stored_source_archive(material)
+                if not archive_path:
+                    raise NonRecoverableError(
+                        'The terraform source {} is missing from the '
+                        'source store.'.format(material['digest']))
+        if archive_path:
+            yield archive_path
+            return
+    if not material or not isinstance(material, (list, str)):
+        yield None
+        return
+    with tempfile.NamedTemporaryFile(suffix='.zip') as f:
+        _base64_to_file(material, f)
+        f.flush()
+        yield f.name
 
 
 def _create_source_path(source_tmp_path):
@@ -329,6 +581,26 @@ def get_terraform_config(target=False):
     return node.properties.get('terraform_config', {})
 
 
+def get_remote_source(location, dir=None, username=None, password=None):
+    """Like get_shared_resource, but remote sources that did not change
+    since the last download are copied from the shared source cache.
+    """
+    def fetch():
+        return get_shared_resource(
+            location, dir=dir, username=username, password=password)
+
+    cache_dir = get_shared_cache_dir(REMOTE_SOURCE_CACHE_DIR) \
+        if RemoteSourceCache.kind(location) else None
+    if not cache_dir:
+        return fetch()
+    source_cache = RemoteSourceCache(cache_dir,
+                                     REMOTE_SOURCE_CACHE_SIZE_LIMIT,
+                                     session=get_url_session(),
+                                     timeout=URL_PROBE_TIMEOUT,
+                                     logger=ctx.logger)
+    return source_cache.get(location, fetch, username, password, dir)
+
+
 def update_terraform_source_material(new_source, target=False):
     """Replace the terraform_source material with a new material.
     This is used in terraform.reload_template operation."""
@@ -349,7 +621,7 @@ def update_terraform_source_material(new_source, target=False):
         new_source_username = new_source_username.secret
     if isinstance(new_source_password, CommonSDKSecret):
         new_source_password = new_source_password.secret
-    source_tmp_path = get_shared_resource(
+    source_tmp_path = get_remote_source(
         new_source_location, dir=node_instance_dir,
         username=new_source_username,
         password=new_source_password)
@@ -366,8 +638,11 @@ def update_terraform_source_material(new_source, target=False):
     # By getting here we will have extracted source
     # Zip the file to store in runtime
     if not v1_gteq_v2(get_cloudify_version(), "6.0.0"):
-        terraform_source_zip = _zip_archive(source_tmp_path)
-        bytes_source = _file_to_base64(terraform_source_zip)
+        manifest = []
+        terraform_source_zip = _zip_archive(source_tmp_path,
+                                            manifest=manifest)
+        bytes_source = _store_source_archive(
+            terraform_source_zip, manifest, target=target)
         os.remove(terraform_source_zip)
         # check if skip_parent_directory was executed
         # reason for that 4 is because in general /tmp/tmpXXXX/single_folder
@@ -617,19 +892,281 @@ def handle_plugins(plugins, plugins_dir, installation_dir):
             'terraform-provider-template_2.1.2_linux_amd64.zip\n'.format(
                 value=plugins)
         )
+    plugin_cache_dir = get_shared_cache_dir(PLUGIN_CACHE_DIR)
+    pending = []
     for plugin_name, plugin_url in plugins.items():
-        with tempfile.NamedTemporaryFile(
-                suffix=".zip",
-                delete=False,
-                dir=installation_dir) as plugin_zip:
-            plugin_zip.close()
-            ctx.logger.debug('Downloading Terraform plugin: {url}'.format(
-                url=plugin_url))
-            download_file(plugin_zip.name, plugin_url)
-            unzip_path = os.path.join(plugins_dir, plugin_name)
-            mkdir_p(os.path.dirname(unzip_path))
-            unzip_and_set_permissions(plugin_zip.name, unzip_path)
-            os.remove(plugin_zip.name)
+        unzip_path = os.path.join(plugins_dir, plugin_name)
+        mkdir_p(os.path.dirname(unzip_path))
+        cache_entry = get_provider_cache_entry(
+            plugin_cache_dir, plugin_name, plugin_url)
+        if cache_entry and os.path.isdir(cache_entry):
+            ctx.logger.debug('Using cached Terraform plugin: {path}'.format(
+                path=cache_entry))
+            link_tree(cache_entry, unzip_path)
+            continue
+        pending.append((plugin_url, unzip_path, cache_entry))
+    if not pending:
+        return
+
+    # Without a shared cache, download into the installation directory.
+    download_dir = get_shared_cache_dir(PROVIDER_DOWNLOADS_DIR) or \
+        tempfile.mkdtemp(dir=installation_dir)
+    downloader = Downloader(download_dir,
+                            session=get_url_session(),
+                            timeout=URL_PROBE_TIMEOUT,
+                            logger=ctx.logger)
+    ctx.logger.debug('Downloading Terraform plugins: {urls}'.format(
+        urls=[url for url, _, _ in pending]))
+    try:
+        downloads = downloader.download_all(
+            [url for url, _, _ in pending])
+    except DownloadError as e:
+        raise NonRecoverableError(
+            'Failed to download Terraform plugins: {}'.format(e))
+    for plugin_url, unzip_path, cache_entry in pending:
+        if cache_entry:
+            _add_provider_to_cache(downloads[plugin_url], cache_entry)
+            link_tree(cache_entry, unzip_path)
+        else:
+            unzip_and_set_permissions(downloads[plugin_url], unzip_path)
+    if download_dir.startswith(os.path.join(installation_dir, '')):
+        remove_dir(download_dir)
+    else:
+        downloader.prune(PROVIDER_DOWNLOADS_SIZE_LIMIT)
+
+
+def get_binary_store():
+    """The store of executables that the tenant's deployments share, or
+    None if there is no shared cache directory.
+    """
+    store_dir = get_shared_cache_dir(BINARY_STORE_DIR)
+    if store_dir:
+        return BinaryStore(store_dir,
+                           os.path.dirname(os.path.dirname(store_dir)),
+                           BINARY_STORE_SIZE_LIMIT,
+                           session=get_url_session(),
+                           timeout=URL_PROBE_TIMEOUT,
+                           logger=ctx.logger)
+
+
+def get_binary_owner(name=None):
+    owner = '{}/{}'.format(ctx.deployment.id, get_ctx_instance().id)
+    return '{}.{}'.format(owner, name) if name else owner
+
+
+def install_executable(installation_dir,
+                       executable_path,
+                       installation_source,
+                       suffix=None,
+                       name=None):
+    """Install an executable from installation_source, by linking it from
+    the binary store if there is one, and otherwise with install_binary.
+    """
+    binary_store = get_binary_store() if installation_source else None
+    if binary_store:
+        try:
+            return binary_store.install(installation_source,
+                                        executable_path,
+                                        get_binary_owner(name),
+                                        suffix)
+        except DownloadError as e:
+            raise NonRecoverableError(
+                'Failed to download {source}: {error}'.format(
+                    source=installation_source, error=e))
+    if os.path.isfile(executable_path) and \
+            os.stat(executable_path).st_nlink > 1:
+        # Never write into a file that is linked from the binary store.
+        os.remove(executable_path)
+    return install_binary(
+        installation_dir, executable_path, installation_source, suffix)
+
+
+def release_executable(name=None):
+    binary_store = get_binary_store()
+    if binary_store:
+        binary_store.release(get_binary_owner(name))
+
+
+def run_concurrently(functions, max_workers=None):
+    """Call the functions in threads that share the operation context, and
+    return the exceptions that they raised, in the order of the functions.
+    After the first failure, the functions that did not start are cancelled,
+    and the ones that are running are waited for.
+    """
+    functions = list(functions)
+    if len(functions) < 2:
+        errors = []
+        for function in functions:
+            try:
+                function()
+            except Exception as e:
+                errors.append(e)
+        return errors
+    try:
+        _ctx = current_ctx.get_ctx()
+        parameters = current_ctx.get_parameters()
+    except NotInContext:
+        _ctx = parameters = None
+
+    failed = threading.Event()
+
+    def call(function):
+        if failed.is_set():
+            return
+        try:
+            if _ctx is None:
+                return function()
+            with current_ctx.push(_ctx, parameters):
+                return function()
+        except Exception:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers or len(functions)) as executor:
+        futures = [executor.submit(call, function) for function in functions]
+        _, pending = wait_futures(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+    return [future.exception() for future in futures
+            if not future.cancelled() and future.exception()]
+
+
+def get_provider_cache_entry(plugin_cache_dir, plugin_name, plugin_url):
+    """The directory of a provider package in the plugin cache, using
+    Terraform's layout: <host>/<namespace>/<type>/<version>/<os>_<arch>.
+    We only know where a package goes if the plugin name is a full provider
+    address and the URL is a release archive, otherwise we return None.
+    """
+    match = re.search(PROVIDER_PACKAGE_PATTERN, plugin_url)
+    if not plugin_cache_dir or not match or \
+            len(plugin_name.strip('/').split('/')) != 3:
+        return
+    return os.path.join(plugin_cache_dir,
+                        *plugin_name.strip('/').split('/'),
+                        match.group('version'),
+                        '{os}_{arch}'.format(**match.groupdict()))
+
+
+def _add_provider_to_cache(plugin_zip, cache_entry):
+    mkdir_p(os.path.dirname(cache_entry))
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(cache_entry))
+    unzip_and_set_permissions(plugin_zip, tmp_dir)
+    try:
+        os.rename(tmp_dir, cache_entry)
+    except OSError:
+        # Another node instance added it first.
+        remove_dir(tmp_dir)
+
+
+def link_tree(source, target):
+    """Hard link the files under source into target, or copy them when
+    they are on another file system.
+    """
+    for dir_name, _, filenames in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dir_name, source))
+        mkdir_p(target_dir)
+        for filename in filenames:
+            target_path = os.path.join(target_dir, filename)
+            if os.path.lexists(target_path):
+                os.remove(target_path)
+            try:
+                os.link(os.path.join(dir_name, filename), target_path)
+            except OSError:
+                shutil.copy2(os.path.join(dir_name, filename), target_path)
+
+
+def get_plugin_cache_dir(size_limit):
+    """The TF_PLUGIN_CACHE_DIR shared by all the tenant's deployments,
+    or None when the cache is disabled with a size limit of 0.
+    """
+    if size_limit:
+        return get_shared_cache_dir(PLUGIN_CACHE_DIR)
+
+
+def _plugin_cache_entries(plugin_cache_dir):
+    return [p for p in glob.glob(os.path.join(plugin_cache_dir, *['*'] * 5))
+            if os.path.isdir(p)]
+
+
+def _tree_size(dir_path):
+    return sum(os.path.getsize(os.path.join(dir_name, filename))
+               for dir_name, _, filenames in os.walk(dir_path)
+               for filename in filenames)
+
+
+def has_broken_links(dir_path):
+    for dir_name, subdirs, filenames in os.walk(dir_path):
+        for name in subdirs + filenames:
+            if not os.path.exists(os.path.join(dir_name, name)):
+                return True
+    return False
+
+
+def _linked_plugin_cache_entries(plugin_cache_dir, root_module):
+    entries = set()
+    for link in glob.glob(os.path.join(
+            root_module, '.terraform', 'providers', *['*'] * 5)):
+        entry = os.path.realpath(link)
+        if entry.startswith(os.path.join(plugin_cache_dir, '')):
+            entries.add(entry)
+    return entries
+
+
+def update_plugin_cache(plugin_cache_dir, root_module, size_limit):
+    """Record the providers that the root module links from the plugin
+    cache, then evict the least recently used providers until the cache
+    fits in size_limit megabytes. Providers that a recorded root module
+    still links are never evicted, and neither are providers that were used
+    during the grace period, because an init may be linking them. The usage
+    file is shared by the operations of all the deployments, so it's updated
+    under a lock.
+    """
+    usage_path = os.path.join(plugin_cache_dir, PLUGIN_CACHE_USAGE_FILE)
+    with file_lock(os.path.join(plugin_cache_dir, PLUGIN_CACHE_LOCK_FILE)):
+        usage = load_json_file(usage_path)
+        if 'entries' not in usage:
+            # The usage file didn't record the root modules before.
+            usage = {'entries': usage, 'modules': {}}
+        last_used = usage['entries']
+        modules = usage.setdefault('modules', {})
+        now = time.time()
+        linked = _linked_plugin_cache_entries(plugin_cache_dir, root_module)
+        for entry in linked:
+            last_used[entry] = now
+        modules[root_module] = sorted(linked)
+
+        entries = _plugin_cache_entries(plugin_cache_dir)
+        sizes = dict((entry, _tree_size(entry)) for entry in entries)
+        total = sum(sizes.values())
+        limit = size_limit * 1024 * 1024
+        referenced = set()
+        if total > limit:
+            # Links change with every init, so count them again.
+            for module in list(modules):
+                if not os.path.isdir(module):
+                    del modules[module]
+                    continue
+                module_entries = _linked_plugin_cache_entries(
+                    plugin_cache_dir, module)
+                modules[module] = sorted(module_entries)
+                referenced.update(module_entries)
+        entries.sort(key=lambda e: last_used.get(e) or os.path.getmtime(e))
+        for entry in entries:
+            if total <= limit:
+                break
+            if entry in referenced:
+                continue
+            if now - (last_used.get(entry) or os.path.getmtime(entry)) < \
+                    PLUGIN_CACHE_GRACE_PERIOD:
+                break
+            ctx.logger.debug(
+                'Evicting {} from the plugin cache.'.format(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+            last_used.pop(entry, None)
+        usage['entries'] = dict(
+            (k, v) for k, v in last_used.items() if os.path.isdir(k))
+        dump_json_file(usage_path, usage)
 
 
 def dump_file(output, work_directory, file_name):
@@ -640,14 +1177,240 @@ def dump_file(output, work_directory, file_name):
         fd.close()
 
 
-def extract_binary_tf_data(root_dir, data, source_path):
-    """Take this encoded data and put it in a zip file and then unzip it."""
-    with tempfile.NamedTemporaryFile(dir=root_dir, delete=False) as f:
-        base64.decode(StringIO(data), f)
-        terraform_source_zip = f.name
-    # By getting here, "terraform_source_zip" is the path
-    #  to a ZIP file containing the Terraform files.
-    _unzip_archive(terraform_source_zip, root_dir, source_path)
+def load_json_file(file_path):
+    """Read a JSON document written by dump_json_file.
+    Missing or corrupt files are treated as empty.
+    """
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def dump_json_file(file_path, data):
+    """Atomically replace file_path with a JSON dump of data."""
+    with tempfile.NamedTemporaryFile(mode='w',
+                                     dir=os.path.dirname(file_path),
+                                     delete=False) as f:
+        json.dump(data, f)
+    os.replace(f.name, file_path)
+
+
+def get_shared_cache_dir(*subdirs):
+    """A directory that is shared by all of the tenant's deployments on the
+    manager. We keep material there that does not belong to a single node
+    instance. Returns None if the deployments directory is not available.
+    """
+    try:
+        deployment_dir = get_deployment_dir(ctx.deployment.id)
+    except Exception:
+        return
+    cache_dir = os.path.join(
+        os.path.dirname(deployment_dir), SHARED_CACHE_DIR, *subdirs)
+    mkdir_p(cache_dir)
+    return cache_dir
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_sha256(file_path):
+    """Return the sha256 of a file. Digests of large files, like the
+    Terraform binary, are remembered in the shared cache by path, inode,
+    size and mtime, so that we only hash them again when they change.
+    """
+    file_stat = os.stat(file_path)
+    key = [file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns]
+    cache_dir = get_shared_cache_dir()
+    if not cache_dir:
+        return _sha256(file_path)
+    index_path = os.path.join(cache_dir, 'digests.json')
+    index = load_json_file(index_path)
+    cached = index.get(file_path)
+    if cached and cached[:3] == key:
+        return cached[3]
+    digest = _sha256(file_path)
+    index = load_json_file(index_path)
+    index[file_path] = key + [digest]
+    dump_json_file(index_path, index)
+    return digest
+
+
+def set_executable(file_path):
+    """Add the owner's executable bit in-process, without forking chmod."""
+    if not os.access(file_path, os.X_OK):
+        os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IXUSR)
+
+
+def _path_signature(path):
+    path_stat = os.stat(path)
+    return [path_stat.st_ino, path_stat.st_mtime_ns]
+
+
+def _changed_paths(signatures):
+    for path, signature in signatures.items():
+        try:
+            if _path_signature(path) != signature:
+                yield path
+        except OSError:
+            yield path
+
+
+def make_providers_executable(root_module):
+    """Make every file under <root_module>/.terraform executable.
+
+    We keep an index of the path, inode and mtime of every provider file
+    that we made executable, and of the directories that they are in.
+    Adding, removing or renaming a file changes the signature of its parent
+    directory, and then we walk the tree again. Otherwise only the files
+    whose own signature changed are made executable again.
+    """
+    providers_path = os.path.join(root_module, '.terraform')
+    if not os.path.isdir(providers_path):
+        return
+    index_path = os.path.join(root_module, PROVIDERS_INDEX_FILE)
+    index = load_json_file(index_path)
+    if index.get('path') == providers_path and index.get('directories') \
+            and not any(_changed_paths(index['directories'])):
+        files = index.get('files', {})
+        changed = list(_changed_paths(files))
+        if not changed:
+            return
+        for provider_path in changed:
+            try:
+                set_executable(provider_path)
+                files[provider_path] = _path_signature(provider_path)
+            except OSError:
+                files.pop(provider_path)
+        dump_json_file(index_path, index)
+        return
+    directories = {}
+    files = {}
+    for dir_name, _, filenames in os.walk(providers_path):
+        directories[dir_name] = _path_signature(dir_name)
+        for filename in filenames:
+            provider_path = os.path.join(dir_name, filename)
+            if os.path.isfile(provider_path):
+                set_executable(provider_path)
+                files[provider_path] = _path_signature(provider_path)
+    dump_json_file(index_path, {'path': providers_path,
+                                'directories': directories,
+                                'files': files})
+
+
+def get_module_digest(root_module, suffixes=None):
+    """Hash the files of a module tree, or only the ones with suffixes.
+    Every file counts, since file() and templatefile() can read anything,
+    except what the plugin and terraform write next to the module.
+    """
+    digest = hashlib.sha256()
+    for dir_name, subdirs, filenames in os.walk(root_module):
+        subdirs[:] = sorted(d for d in subdirs
+                            if d not in MODULE_DIGEST_EXCLUDE)
+        for filename in sorted(filenames):
+            if filename in MODULE_DIGEST_EXCLUDE or \
+                    suffixes and not filename.endswith(suffixes):
+                continue
+            file_path = os.path.join(dir_name, filename)
+            digest.update(
+                os.path.relpath(file_path, root_module).encode('utf-8'))
+            digest.update(_sha256(file_path).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_tree_signature(dir_path):
+    """The relative path, size and mtime of every file under dir_path."""
+    if not dir_path or not os.path.isdir(dir_path):
+        return
+    signature = []
+    for dir_name, subdirs, filenames in os.walk(dir_path):
+        subdirs.sort()
+        for filename in sorted(filenames):
+            file_stat = os.stat(os.path.join(dir_name, filename))
+            signature.append([
+                os.path.relpath(os.path.join(dir_name, filename), dir_path),
+                file_stat.st_size,
+                file_stat.st_mtime_ns])
+    return signature
+
+
+def _file_record(file_path, digest):
+    file_stat = os.stat(file_path)
+    return [file_stat.st_size, file_stat.st_mtime_ns, digest]
+
+
+def sync_source_material(root_dir, material, delete_stale=True):
+    """Make the files of root_dir match the manifest of the material, and
+    only extract the files that are missing or changed.
+
+    We record the size, mtime and sha256 of every file that we synced in
+    root_dir, so a file that still has the same size and mtime is not read
+    again. When delete_stale is set, files that we synced before, that are
+    not in the manifest anymore and that nobody changed since, are removed.
+    """
+    record_path = os.path.join(root_dir, SOURCE_SYNC_FILE)
+    recorded = load_json_file(record_path)
+    files = {}
+    changed = []
+    for path, size, digest in material['manifest']:
+        file_path = os.path.join(root_dir, path)
+        try:
+            record = _file_record(file_path, digest)
+        except OSError:
+            changed.append(path)
+            continue
+        if record == recorded.get(path) or \
+                (record[0] == size and _sha256(file_path) == digest):
+            files[path] = record
+        else:
+            changed.append(path)
+
+    if changed:
+        ctx.logger.debug('Extracting {count} changed source files.'.format(
+            count=len(changed)))
+        digests = dict((p, d) for p, _, d in material['manifest'])
+        with source_archive(material) as archive_path:
+            with zipfile.ZipFile(archive_path) as zip_file:
+                for path in changed:
+                    file_path = os.path.join(root_dir, path)
+                    _extract_member(zip_file, zip_file.getinfo(path),
+                                    file_path)
+                    files[path] = _file_record(file_path, digests[path])
+
+    if delete_stale:
+        for path, record in recorded.items():
+            file_path = os.path.join(root_dir, path)
+            if path in files or \
+                    os.path.basename(path).startswith(TERRAFORM_STATE_FILE):
+                continue
+            try:
+                if _file_record(file_path, record[2]) == record:
+                    os.remove(file_path)
+            except OSError:
+                continue
+    else:
+        for path, record in recorded.items():
+            files.setdefault(path, record)
+
+    if files != recorded:
+        dump_json_file(record_path, files)
+
+
+def extract_binary_tf_data(root_dir, data, source_path, delete_stale=True):
+    """Take this material and unzip it."""
+    if isinstance(data, dict) and data.get('manifest') is not None:
+        sync_source_material(root_dir, data, delete_stale)
+        return
+    with source_archive(data) as terraform_source_zip:
+        # By getting here, "terraform_source_zip" is the path
+        #  to a ZIP file containing the Terraform files.
+        _unzip_archive(terraform_source_zip, root_dir, source_path)
 
 
 @contextmanager
@@ -668,9 +1431,11 @@ def update_terraform_source(new_source=None, new_source_path=None, tf=None):
         material = get_terraform_source_material()
     node_instance_dir = get_node_instance_dir(source_path=new_source_path)
     module_root = get_storage_path()
-    ctx.logger.debug('The storage root tree:\n{}'.format(tree(module_root)))
+    ctx.logger.debug('The storage root tree:\n%s', LazyTree(module_root))
     if material:
-        extract_binary_tf_data(module_root, material, new_source_path)
+        # The new material is only the source, keep the rest of the files.
+        extract_binary_tf_data(module_root, material, new_source_path,
+                               delete_stale=False)
     else:
         if isinstance(new_source, str) and os.path.isdir(new_source):
             if new_source_path:
@@ -703,8 +1468,7 @@ def _yield_terraform_source(material, source_path=None):
     source_path = source_path or get_source_path()
     if material:
         extract_binary_tf_data(module_root, material, source_path)
-    ctx.logger.debug(
-        'The storage root tree:\n{}'.format(tree(module_root)))
+    ctx.logger.debug('The storage root tree:\n%s', LazyTree(module_root))
     path_to_init_dir = get_node_instance_dir(source_path=source_path)
     try:
         ctx.logger.debug('_yield_terraform_source {}'.format(path_to_init_dir))
@@ -727,27 +1491,37 @@ def _yield_terraform_source(material, source_path=None):
 def store_binary_material(module_root, ):
     ctx.logger.debug('Re-packaging Terraform files from {loc}'.format(
         loc=module_root))
+    source_path = get_source_path()
+    root_module = os.path.join(module_root, source_path) \
+        if source_path else module_root
+    manifest = []
     archived_file = _zip_archive(
         module_root,
         exclude_files=[get_executable_path(),
-                       get_plugins_dir()])
-    # Convert the zip archive into base64 for storage in runtime
-    # properties.
-    base64_rep = _file_to_base64(archived_file)
-    os.remove(archived_file)
-
-    ctx.logger.warn('The after base64_rep size is {size}.'.format(
-        size=len(base64_rep)))
-
-    if len(base64_rep) > get_ctx_node().properties.get(
-            'max_runtime_property_size', 100000):
-        raise Exception('Not storing terraform_source, '
-                        'because its size is {}'.format(len(base64_rep)))
+                       get_plugins_dir(),
+                       os.path.join(root_module, PLAN_CACHE_DIR),
+                       os.path.join(root_module, PROVIDERS_INDEX_FILE),
+                       os.path.join(root_module, INIT_FINGERPRINT_FILE),
+                       os.path.join(module_root, SOURCE_SYNC_FILE)],
+        manifest=manifest)
+    # Put the zip archive in the source store, or convert it into base64
+    # for storage in runtime properties.
+    try:
+        material = _store_source_archive(
+            archived_file,
+            manifest,
+            max_size=get_ctx_node().properties.get(
+                'max_runtime_property_size', 100000))
+    finally:
+        os.remove(archived_file)
+
+    if isinstance(material, dict):
+        ctx.logger.info('Storing "terraform source" {digest} in the source '
+                        'store.'.format(digest=material['digest']))
     else:
         ctx.logger.info('Storing zip "terraform source" in '
                         'runtime properties.')
-        ctx.instance.runtime_properties['terraform_source'] = \
-            base64_rep
+    ctx.instance.runtime_properties['terraform_source'] = material
 
 
 def try_to_copy_old_state_file(target_dir):
@@ -781,42 +1555,59 @@ def get_terraform_state_file(target_dir=None):
     storage_path = get_storage_path()
     state_file_path = os.path.join(storage_path, TERRAFORM_STATE_FILE)
     encoded_source = get_terraform_source_material()
-    source_path = get_source_path()
-
-    # with tempfile.NamedTemporaryFile(delete=False) as f:
-    with tempfile.NamedTemporaryFile() as f:
-        base64.decode(StringIO(encoded_source), f)
-        try:
-            extracted_source = _unzip_archive(f.name,
-                                              storage_path,
-                                              source_path)
-        except zipfile.BadZipFile:
-            extracted_source = None
-
-    if not extracted_source:
+    if isinstance(encoded_source, dict) and \
+            encoded_source.get('manifest') is not None and \
+            not any(_is_state_member(path)
+                    for path, _, _ in encoded_source['manifest']):
+        # Like an archive without a state, there is nothing to dump.
+        ctx.logger.debug('TF State file: {}.'.format(state_file_path))
+        return state_file_path
+
+    if not encoded_source:
         return
 
-    for dir_name, subdirs, filenames in os.walk(extracted_source):
-        for filename in filenames:
-            if filename == TERRAFORM_STATE_FILE:
-                state_file_from_storage = os.path.join(dir_name, filename)
-                if not os.path.exists(state_file_path):
-                    ctx.logger.warn(
-                        'There is no existing state file {loc}.'.format(
-                            loc=state_file_path))
-                if not filecmp.cmp(state_file_from_storage, state_file_path):
-                    ctx.logger.warn(
-                        'State file from storage is not the same as the '
-                        'existing state file {loc}. Using any way.'.format(
-                            loc=state_file_path))
-                shutil.move(os.path.join(dir_name, filename), state_file_path)
-                break
+    # Only the state is read from the archive, through its central
+    # directory, so this does not depend on the size of the module.
+    try:
+        with source_archive(encoded_source) as archive_path:
+            if not archive_path:
+                return
+            with zipfile.ZipFile(archive_path) as zip_file:
+                members = [m for m in zip_file.infolist()
+                           if _is_state_member(m.filename)]
+                if members:
+                    state_member = min(
+                        members, key=lambda m: m.filename.count('/'))
+                    with tempfile.NamedTemporaryFile(
+                            dir=storage_path, delete=False) as f:
+                        with zip_file.open(state_member) as src:
+                            shutil.copyfileobj(src, f, CHUNK_SIZE)
+    except (zipfile.BadZipFile, binascii.Error, NonRecoverableError) as e:
+        ctx.logger.debug(
+            'Unable to read the TF State file from the terraform '
+            'source: {error}.'.format(error=e))
+        return
 
-    shutil.rmtree(extracted_source)
+    if members:
+        if not os.path.exists(state_file_path):
+            ctx.logger.warn(
+                'There is no existing state file {loc}.'.format(
+                    loc=state_file_path))
+        elif not filecmp.cmp(f.name, state_file_path, shallow=False):
+            ctx.logger.warn(
+                'State file from storage is not the same as the '
+                'existing state file {loc}. Using any way.'.format(
+                    loc=state_file_path))
+        os.replace(f.name, state_file_path)
     ctx.logger.debug('TF State file: {}.'.format(state_file_path))
     return state_file_path
 
 
+def _is_state_member(path):
+    return not path.endswith('/') and \
+        path.rsplit('/', 1)[-1] == TERRAFORM_STATE_FILE
+
+
 def create_backend_string(name, options):
     name = name.strip('"')
     backend_block = convert_json_hcl(extract_hcl_from_dict(
@@ -918,6 +1709,46 @@ def refresh_resources_properties(state, output, update_runtime_props=True):
         store_sensitive_properties(output=output)
 
 
+def index_state_resources(state):
+    """Map the address of every resource instance in a state, as returned
+    by terraform state pull, like module.a["x"].aws_instance.b[0], to the
+    instance.
+    """
+    index = {}
+    states = state if isinstance(state, list) else [state or {}]
+    for module_state in states:
+        for resource in module_state.get('resources', []):
+            address = '{}.{}'.format(resource.get('type'),
+                                     resource.get('name'))
+            if resource.get('mode') == 'data':
+                address = 'data.{}'.format(address)
+            if resource.get('module'):
+                address = '{}.{}'.format(resource['module'], address)
+            for instance in resource.get('instances', []):
+                index_key = instance.get('index_key')
+                if index_key is None:
+                    index[address] = instance
+                else:
+                    index['{}[{}]'.format(
+                        address, json.dumps(index_key))] = instance
+    return index
+
+
+def get_plan_outputs(plan_json):
+    """The outputs of the state that a plan was made from, in the format of
+    terraform output -json. Returns None if the plan doesn't have them,
+    for example older Terraform versions don't store the output types.
+    """
+    if not isinstance(plan_json, dict):
+        return
+    prior_state = plan_json.get('prior_state')
+    if not isinstance(prior_state, dict):
+        return
+    outputs = prior_state.get('values', {}).get('outputs', {})
+    if all('type' in output for output in outputs.values()):
+        return outputs
+
+
 def refresh_resources_drifts_properties(plan_json):
     """
         Store all drifts(changes) in resources we created in runtime
@@ -947,12 +1778,69 @@ def refresh_resources_drifts_properties(plan_json):
     ctx.instance.runtime_properties[DRIFTS] = drifts
 
 
-def is_url(string):
+_url_session = None
+_url_session_lock = threading.Lock()
+_probed_urls = {'operation': None, 'urls': {}}
+
+
+def get_url_session():
+    """A session, so that probes to the same host reuse connections."""
+    global _url_session
+    with _url_session_lock:
+        if not _url_session:
+            _url_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=10)
+            _url_session.mount('http://', adapter)
+            _url_session.mount('https://', adapter)
+        return _url_session
+
+
+def get_operation_key():
+    """Identify the current operation, or None outside of one."""
+    try:
+        return ctx.execution_id, ctx.operation.name, ctx.instance.id
+    except Exception:
+        return None
+
+
+def probe_url(url):
+    """Return the status code of a URL, without downloading it. If the
+    server does not support HEAD, request only the first byte. Returns
+    None if the server is not reachable. Results are remembered for the
+    current operation.
+    """
+    operation = get_operation_key()
+    if _probed_urls['operation'] != operation:
+        _probed_urls.update(operation=operation, urls={})
+    if url in _probed_urls['urls']:
+        return _probed_urls['urls'][url]
+    session = get_url_session()
     try:
-        result = requests.get(string)
-    except requests.ConnectionError:
+        response = session.head(
+            url, allow_redirects=True, timeout=URL_PROBE_TIMEOUT)
+        if response.status_code in [405, 501]:
+            response = session.get(url,
+                                   headers={'Range': 'bytes=0-0'},
+                                   stream=True,
+                                   timeout=URL_PROBE_TIMEOUT)
+            response.close()
+        status_code = response.status_code
+    except (requests.ConnectionError, requests.Timeout):
+        status_code = None
+    _probed_urls['urls'][url] = status_code
+    return status_code
+
+
+def is_url(string):
+    if not isinstance(string, str):
+        return False
+    parsed = urlparse(string.strip())
+    if parsed.scheme not in ['http', 'https'] or not parsed.netloc:
         return False
-    if result.status_code == 404:
+    status_code = probe_url(string.strip())
+    if status_code is None:
+        return False
+    if status_code == 404:
         ctx.logger.warn('The source {source} is a valid URL, '
                         'but is not found.'.format(source=string))
     return True
@@ -1019,7 +1907,11 @@ class CapturingOutputConsumer(OutputConsumer):
         return self.buffer
 
 
-def tree(dir_path, level=-1, limit_to_directories=False, length_limit=1000000):
+def tree(dir_path,
+         level=-1,
+         limit_to_directories=False,
+         length_limit=1000000,
+         exclude=None):
     """Stolen from here: https://stackoverflow.com/questions/9727673/
     list-directory-tree-structure-in-python
 
@@ -1027,6 +1919,7 @@ def tree(dir_path, level=-1, limit_to_directories=False, length_limit=1000000):
     :param level:
     :param limit_to_directories:
     :param length_limit:
+    :param exclude: Names of directories that are listed but not walked.
     :return:
     """
 
@@ -1037,6 +1930,7 @@ def tree(dir_path, level=-1, limit_to_directories=False, length_limit=1000000):
 
     if not isinstance(dir_path, Path):
         dir_path = Path(dir_path)
+    exclude = exclude or []
 
     files = 0
     directories = 0
@@ -1053,11 +1947,14 @@ def tree(dir_path, level=-1, limit_to_directories=False, length_limit=1000000):
             contents = [d for d in dir_path.iterdir() if d.is_dir()]
         else:
             contents = list(dir_path.iterdir())
+        contents.sort()
         pointers = [tee] * (len(contents) - 1) + [last]
         for pointer, path in zip(pointers, contents):
             if path.is_dir():
                 yield prefix + pointer + path.name
                 directories += 1
+                if path.name in exclude:
+                    continue
                 extension = branch if pointer == tee else space
                 yield from inner(path, prefix=prefix+extension, level=level-1)
             elif not limit_to_directories:
@@ -1076,6 +1973,29 @@ def tree(dir_path, level=-1, limit_to_directories=False, length_limit=1000000):
     return '\n'.join(tree_lines)
 
 
+class LazyTree(object):
+    """A tree of a directory for log messages, that is only rendered when
+    the message is emitted, e.g.
+    ctx.logger.debug('The tree:\n%s', LazyTree(path)).
+    """
+
+    def __init__(self,
+                 dir_path,
+                 level=TREE_DEPTH_LIMIT,
+                 length_limit=TREE_LENGTH_LIMIT,
+                 exclude=TREE_EXCLUDE_DIRS):
+        self.dir_path = dir_path
+        self.level = level
+        self.length_limit = length_limit
+        self.exclude = exclude
+
+    def __str__(self):
+        return tree(self.dir_path,
+                    level=self.level,
+                    length_limit=self.length_limit,
+                    exclude=self.exclude)
+
+
 def resolve_dict_intrinsic_vals(dict_val, dep_id):
     # could be intrinsic function directly
     resolved_dict = resolve_intrinsic_functions(dict_val, dep_id)
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 from cloudify.exceptions import NonRecoverableError
+from cloudify.workflows.tasks import HandlerResult
 
 HIERARCHY = 'type_hierarchy'
 TF_TYPE = 'cloudify.nodes.terraform'
@@ -29,13 +30,14 @@ def _terraform_operation(ctx,
                          operation,
                          node_ids,
                          node_instance_ids,
+                         max_concurrency=1,
                          **kwargs):
     if 'force' in kwargs:
         force = kwargs.get('force')
         kwargs['force'] = eval(force)
 
     graph = ctx.graph_mode()
-    sequence = graph.sequence()
+    instances = []
     # Iterate over all node instances of type "cloudify.nodes.terraform.Module"
     # and refresh states.
     for node_instance in ctx.node_instances:
@@ -46,22 +48,125 @@ def _terraform_operation(ctx,
         if 'cloudify.nodes.terraform.Module' in \
                 node_instance.node.type_hierarchy:
             ctx.logger.info("Adding node instance: %s", node_instance.id)
-            sequence.add(
-                node_instance.execute_operation(
-                    operation,
-                    kwargs=kwargs,
-                    allow_kwargs_override=True)
-            )
+            instances.append(node_instance)
 
+    instances, dependencies = _sort_instances(instances)
+    _schedule_instances(
+        graph,
+        [(instance.id, [instance.execute_operation(
+            operation,
+            kwargs=kwargs,
+            allow_kwargs_override=True)]) for instance in instances],
+        dependencies,
+        max_concurrency)
     return graph
 
 
-def refresh_resources(ctx, node_ids, node_instance_ids):
+def _sort_instances(instances):
+    """Order the node instances by their depth in the relationships graph,
+    so that every instance comes after the instances that it depends on,
+    and return the dependencies of each instance among them. Dependencies
+    that would make a cycle are dropped.
+    """
+    by_id = dict((instance.id, instance) for instance in instances)
+    ordered = []
+    dependencies = {}
+    depths = {}
+    visiting = set()
+
+    def visit(instance):
+        if instance.id in dependencies or instance.id in visiting:
+            return
+        visiting.add(instance.id)
+        for relationship in instance.relationships:
+            if relationship.target_id in by_id:
+                visit(by_id[relationship.target_id])
+        visiting.remove(instance.id)
+        dependencies[instance.id] = [
+            r.target_id for r in instance.relationships
+            if r.target_id in dependencies]
+        depths[instance.id] = 1 + max(
+            [depths[d] for d in dependencies[instance.id]] or [-1])
+        ordered.append(instance)
+
+    for instance in instances:
+        visit(instance)
+    ordered.sort(key=lambda instance: depths[instance.id])
+    return ordered, dependencies
+
+
+class _InstanceScheduler(object):
+    """Add the tasks of node instances to the graph once they are ready,
+    so that at most max_concurrency node instances run at the same time.
+    A node instance is ready when everything that it waits for, the
+    instances that it depends on and the hosts that it runs on, succeeded.
+    Its tasks run in order, and it doesn't take a slot before it is ready.
+    """
+
+    def __init__(self, graph, max_concurrency):
+        self.graph = graph
+        self.max_concurrency = int(max_concurrency or 0)
+        self.pending = []
+        self.succeeded = set()
+        self.running = 0
+
+    def add(self, key, tasks, waits_for=None):
+        """Schedule the tasks of a node instance, after the keys that it
+        waits for. Instances are started in the order they were added.
+        """
+        self.pending.append((key, tasks, set(waits_for or [])))
+
+    def wait_for(self, key, task):
+        """Mark key as succeeded when task, already in the graph,
+        succeeds.
+        """
+        task.on_success = self._on_success(key, release=False)
+
+    def start(self):
+        self._schedule()
+
+    def _on_success(self, key, release):
+        def on_success(_):
+            if release:
+                self.running -= 1
+            self.succeeded.add(key)
+            self._schedule()
+            return HandlerResult.cont()
+        return on_success
+
+    def _schedule(self):
+        for item in list(self.pending):
+            if 0 < self.max_concurrency <= self.running:
+                return
+            key, tasks, waits_for = item
+            if not waits_for.issubset(self.succeeded):
+                continue
+            self.pending.remove(item)
+            self.running += 1
+            tasks[-1].on_success = self._on_success(key, release=True)
+            self.graph.sequence().add(*tasks)
+
+
+def _schedule_instances(graph, instance_tasks, dependencies, max_concurrency):
+    """Add the tasks of each node instance to the graph, after the tasks of
+    the instances that it depends on, running at most max_concurrency
+    instances at the same time. instance_tasks is a list of
+    (instance ID, tasks), where instances come after their dependencies.
+    """
+    scheduler = _InstanceScheduler(graph, max_concurrency)
+    for instance_id, tasks in instance_tasks:
+        scheduler.add(instance_id, tasks, dependencies.get(instance_id))
+    scheduler.start()
+    return scheduler
+
+
+def refresh_resources(ctx, node_ids, node_instance_ids, max_concurrency=1):
     _terraform_operation(
         ctx,
         "terraform.refresh",
         node_ids,
-        node_instance_ids).execute()
+        node_instance_ids,
+        max_concurrency).execute()
 
 
 def reload_resources(ctx,
@@ -72,7 +177,8 @@ def reload_resources(ctx,
                      variables,
                      environment_variables,
                      destroy_previous,
-                     force=False):
+                     force=False,
+                     max_concurrency=1):
     kwargs = dict(destroy_previous=destroy_previous)
     if source:
         kwargs['source'] = source
@@ -89,6 +195,7 @@ def reload_resources(ctx,
         "terraform.reload",
         node_ids,
         node_instance_ids,
+        max_concurrency,
         **kwargs).execute()
 
 
@@ -100,7 +207,8 @@ def import_resource(ctx,
                     variables,
                     environment_variables,
                     resource_address,
-                    resource_id):
+                    resource_id,
+                    max_concurrency=1):
     kwargs = dict(resource_address=resource_address)
     kwargs['resource_id'] = resource_id
     if source:
@@ -116,6 +224,7 @@ def import_resource(ctx,
         "terraform.import_resource",
         node_ids,
         node_instance_ids,
+        max_concurrency,
         **kwargs).execute()
 
 
@@ -126,7 +235,8 @@ def run_infracost(ctx,
                   source_path,
                   variables,
                   environment_variables,
-                  infracost_config):
+                  infracost_config,
+                  max_concurrency=1):
     kwargs = {}
     if infracost_config:
         kwargs['infracost_config'] = infracost_config
@@ -143,6 +253,7 @@ def run_infracost(ctx,
         "terraform.infracost",
         node_ids,
         node_instance_ids,
+        max_concurrency,
         **kwargs).execute()
 
 
@@ -171,6 +282,7 @@ def migrate_state(ctx, node_ids=None, node_instance_ids=None, **kwargs):
 def terraform_plan(ctx,
                    node_ids=None,
                    node_instance_ids=None,
+                   max_concurrency=1,
                    **kwargs):
     """Execute the terraform plan on nodes or node instances.
     :param ctx: The Cloudify Workflow Context from Workflow.
@@ -185,7 +297,7 @@ def terraform_plan(ctx,
     """
 
     graph = ctx.graph_mode()
-    sequence = graph.sequence()
+    instances = []
 
     if node_ids and node_instance_ids:
         raise NonRecoverableError(
@@ -198,40 +310,65 @@ def terraform_plan(ctx,
             if 'cloudify.nodes.terraform.Module' not in node.type_hierarchy:
                 continue
             if not node_ids or node.id in node_ids:
-                for instance in node.instances:
-                    _plan_module_instance(
-                        ctx, node, instance, sequence, kwargs)
+                instances.extend(node.instances)
     elif node_instance_ids:
         for instance in ctx.node_instances:
             if instance.id in node_instance_ids:
-                _plan_module_instance(
-                    ctx, instance.node, instance, sequence, kwargs)
+                instances.append(instance)
+
+    instances, dependencies = _sort_instances(instances)
+    scheduler = _InstanceScheduler(graph, max_concurrency)
+    hosts = {}
+    for instance in instances:
+        tasks, host_ids = _plan_module_instance(
+            ctx, instance.node, instance, hosts, kwargs)
+        scheduler.add(instance.id,
+                      tasks,
+                      dependencies.get(instance.id, []) + host_ids)
+    for host_id, relationships in hosts.items():
+        scheduler.wait_for(
+            host_id, _start_terraform_instance(graph, relationships))
+    scheduler.start()
 
     return graph.execute()
 
 
-def _start_terraform_instance(sequence, r):
-    sequence.add(
-        r.target_node_instance.execute_operation(CREATE))
-    sequence.add(
-        r.execute_source_operation(PRECONFIGURE))
+def _start_terraform_instance(graph, relationships):
+    """Add a task sequence that creates the Terraform host, preconfigures
+    the relationships of the node instances that run on it, and sets it to
+    started. Return the last task.
+    """
+    host_instance = relationships[0].target_node_instance
+    sequence = graph.sequence()
     sequence.add(
-        r.target_node_instance.set_state('started'))
+        host_instance.execute_operation(CREATE))
+    for r in relationships:
+        sequence.add(
+            r.execute_source_operation(PRECONFIGURE))
+    started = host_instance.set_state('started')
+    sequence.add(started)
+    return started
 
 
-def _plan_module_instance(ctx, node, instance, sequence, kwargs):
-    """ Create a task sequence that will execute a terraform plan on
-    a list of nodes.
+def _plan_module_instance(ctx, node, instance, hosts, kwargs):
+    """ Create the tasks that will execute a terraform plan on a node
+    instance, and collect the relationships to the Terraform hosts that are
+    not started yet, so that each host is started once, even if it is
+    shared by several node instances.
 
     :param ctx: CloudifyWorkflowContext
     :type ctx: CloudifyWorkflowContext
     :param node: CloudifyWorkflowNode
     :param instance: CloudifyWorkflowNodeInstance
-    :param sequence: TaskSequence
+    :param hosts: The relationships to each host that is not started,
+      by host node instance ID.
+    :type hosts: dict
     :param kwargs:
-    :return: None
+    :return: The tasks of the node instance, in order, and the IDs of the
+      hosts that they have to wait for.
+    :rtype: tuple
     """
-
+    host_ids = []
     for rel in instance.relationships:
         if rel.target_node_instance.state in NOT_STARTED:
             if REL1 not in rel.relationship._relationship[HIERARCHY] or \
@@ -248,24 +385,30 @@ def _plan_module_instance(ctx, node, instance, sequence, kwargs):
                     )
                 )
             else:
-                _start_terraform_instance(sequence, rel)
-    sequence.add(
+                host_id = rel.target_node_instance.id
+                hosts.setdefault(host_id, []).append(rel)
+                host_ids.append(host_id)
+    tasks = [
         instance.execute_operation(
             'terraform.plan',
             kwargs=kwargs,
             allow_kwargs_override=True
         )
-    )
+    ]
+    return tasks, host_ids
 
 
 def update_terraform_binary(ctx,
                             node_ids=None,
                             node_instance_ids=None,
                             installation_source=None,
+                            max_concurrency=1,
                             **kwargs):
     if not installation_source:
         raise NonRecoverableError(
             'You must provided a new URL to Terraform installation source.')
+    # Binaries are updated one at a time, max_concurrency is only accepted
+    # because it's one of the common workflow parameters.
     kwargs['installation_source'] = installation_source
     graph = ctx.graph_mode()
     sequence = graph.sequence()